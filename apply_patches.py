@@ -0,0 +1,57 @@
+#!/usr/bin/python
+#Title			: apply_patches.py
+#Usage			: python apply_patches.py -h
+#Author			: pmorvalho
+#Date			: July 11, 2022
+#Description    	: Rebuilds the code of the programs written as edits to the original program of each student (option -pt of the mutator and of the mutilator).
+#Notes			:
+#Python Version: 3.8.5
+# (C) Copyright 2022 Pedro Orvalho.
+#==============================================================================
+
+from __future__ import print_function
+import sys, os
+import argparse
+from sys import argv
+import pathlib
+
+from helper import *
+
+#-----------------------------------------------------------------
+
+def get_students_dirs(input_dir):
+    # the directory of a student, or the directories of the students of an output directory of the mutator or of the mutilator
+    if os.path.exists(input_dir + '/' + patches_name):
+        return [pathlib.Path(input_dir)]
+    return sorted(d.parent for d in pathlib.Path(input_dir).glob('*/' + patches_name))
+
+def apply_patches(input_dir, output_dir, program):
+    # writes the programs of each student to its directory (or prints the code of a single program). Returns False if the program is not found.
+    for d in get_students_dirs(input_dir):
+        prog_dir = str(d) if output_dir is None else output_dir + '/' + d.name
+        if program is None:
+            os.makedirs(prog_dir, exist_ok=True)
+        for row in read_patched_programs(str(d)):
+            if program is None:
+                with open(prog_dir + '/' + row["program"] + ".c", 'w') as writer:
+                    writer.write(row["source"])
+            elif row["program"] == program:
+                print(row["source"], end="")
+                return True
+    return program is None
+
+#-----------------------------------------------------------------
+
+def parser():
+    parser = argparse.ArgumentParser(prog='apply_patches.py', formatter_class=argparse.RawTextHelpFormatter)
+    parser.add_argument('-d', '--input_dir', required=True, help='Output directory of the mutator or of the mutilator, or the directory of one of its students.')
+    parser.add_argument('-o', '--output_dir', help='Directory where the programs of each student are written (in a directory per student). (Default = the directory of each student).')
+    parser.add_argument('-p', '--program', help='Name of a program (e.g. 0-1-0-0-00-0) whose code is printed, instead of writing the programs.')
+    args = parser.parse_args(argv[1:])
+    return args
+
+if __name__ == "__main__":
+    args = parser()
+    if not apply_patches(args.input_dir, args.output_dir, args.program):
+        print("Program not found:", args.program, file=sys.stderr)
+        exit(1)
@@ -0,0 +1,338 @@
+#!/usr/bin/python
+#Title			: augmentation_server.py
+#Usage			: python augmentation_server.py -h
+#Author			: pmorvalho
+#Date			: July 04, 2022
+#Description    	: Augmentation server - generates mutated/mutilated programs on demand, over HTTP on localhost or on a Unix socket.
+#Notes			: The programs are parsed and analysed once by the worker processes, and kept in memory for the following requests.
+#Python Version: 3.8.5
+# (C) Copyright 2022 Pedro Orvalho.
+#==============================================================================
+
+from __future__ import print_function
+import sys, os
+import argparse
+from sys import argv
+import pathlib
+import hashlib
+import json
+import queue
+import signal
+import threading
+import multiprocessing
+import socketserver
+from collections import OrderedDict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import prog_mutator
+import prog_mutilator
+
+#-----------------------------------------------------------------
+
+# the names of the mutations (see README.md) and of the options of the mutator and of the mutilator that perform them
+mutations_names = {"M1" : "comp_ops", "M2" : "if_else", "M3" : "incr_ops", "M4" : "reord_decls", "M5" : "for_2_while", "M6" : "dummy_var"}
+mutilations_names = {"B1" : "comp_ops", "B2" : "var_mu", "B3" : "asg_del"}
+# number of programs of a request sent at once by the workers
+batch_size = 50
+# number of requests waiting for each worker, and of batches waiting to be sent (for all the requests, and for each request)
+queue_size = 16
+stream_size = 4
+# maximum number of programs of a request
+max_num = 10000
+# number of slots of the ids of the requests cancelled, shared with the workers
+cancelled_size = 1024
+
+#-----------------------------------------------------------------
+# The programs analysed by a worker, the least recently used are removed once there are more than max_programs.
+class AnalysedPrograms:
+
+    def __init__ (self, max_programs):
+        self.max_programs = max_programs
+        self.programs = OrderedDict()
+
+    def get(self, tool, source, config):
+        key = (tool.__name__, hashlib.sha1(source.encode()).hexdigest())
+        if key in self.programs:
+            self.programs.move_to_end(key)
+            return self.programs[key]
+        analysed = tool.analyse_source(source, config)
+        self.programs[key] = analysed
+        if len(self.programs) > self.max_programs:
+            self.programs.popitem(last=False)
+        return analysed
+
+def get_mutilated_mutant(code, config):
+    # the mutant with all the mutilations required, i.e. the last program of a single mutilation of each kind (None if it does not parse)
+    last = prog_mutilator.get_mutilated_program(code, -1, config)
+    # the index of each mutilation is 0 in the programs without it
+    if last is None or any(i.strip("0") == "" for i in last[3].values()):
+        return None
+    return last
+
+def gen_rows(request, source, programs):
+    # Generator of the rows of a request (in the same format as the rows of the datasets), with the mutations (M*) and the mutilations (B*)
+    # of the request. When both are required, the mutated programs are mutilated.
+    names = request.get("mutations", [])
+    unknown = [m for m in names if m not in mutations_names and m not in mutilations_names]
+    if unknown != []:
+        raise ValueError("Unknown mutations: {m}".format(m=", ".join(unknown)))
+    num_progs = request.get("num", 1)
+    seed = request.get("seed")
+    mutations = {mutations_names[m] : True for m in names if m in mutations_names}
+    mutilations = {mutilations_names[m] : True for m in names if m in mutilations_names}
+    student = request.get("program", "source")
+    # the programs are drawn at random, and the original program is left out
+    if mutilations == {}:
+        config = prog_mutator.get_config(seed=seed, **mutations)
+        analysed = programs.get(prog_mutator, source, config)
+        for code, var_map, mutation_vector in prog_mutator.mutate(source, config, num_progs, analysed, skip_original=True):
+            yield {"student": student, "program": prog_mutator.get_prog_name(mutation_vector), "mutations": mutation_vector, "source": code, "var_map": var_map}
+    elif mutations == {}:
+        config = prog_mutilator.get_config(seed=seed, **mutilations)
+        analysed = programs.get(prog_mutilator, source, config)
+        for code, var_map, bug_map, mutilation_vector in prog_mutilator.mutilate(source, config, num_progs, analysed, random_order=True):
+            yield {"student": student, "program": prog_mutilator.get_prog_name(mutilation_vector), "mutations": mutilation_vector, "source": code,
+                   "var_map": var_map, "bug_map": bug_map}
+    else:
+        config = prog_mutator.get_config(seed=seed, **mutations)
+        analysed = programs.get(prog_mutator, source, config)
+        # each mutated program gets a single mutilation of each kind required
+        m_config = prog_mutilator.get_config(seed=seed, single=True, **mutilations)
+        for code, var_map, mutation_vector in prog_mutator.mutate(source, config, num_progs, analysed, skip_original=True):
+            mutilated = get_mutilated_mutant(code, m_config)
+            if mutilated is None:
+                continue
+            m_code, _, bug_map, mutilation_vector = mutilated
+            vector = dict(mutation_vector)
+            vector.update({"B-"+k : x for k, x in mutilation_vector.items()})
+            yield {"student": student, "program": prog_mutator.get_prog_name(mutation_vector)+"-"+prog_mutilator.get_prog_name(mutilation_vector),
+                   "mutations": vector, "source": m_code, "var_map": var_map, "bug_map": bug_map}
+
+def worker_loop(tasks, results, cancelled, max_programs):
+    # each worker keeps the programs it analysed, the requests of the same program are always sent to the same worker.
+    # cancelled holds the ids of the requests cancelled (see WorkerPool.cancel), whose programs are no longer generated.
+    programs = AnalysedPrograms(max_programs)
+    # Ctrl-C only stops the server, which stops its workers
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    while True:
+        task = tasks.get()
+        if task is None:
+            return
+        task_id, request, source = task
+        if cancelled[task_id % cancelled_size] == task_id:
+            results.put((task_id, None))
+            continue
+        rows = []
+        try:
+            for row in gen_rows(request, source, programs):
+                rows.append(row)
+                if len(rows) >= batch_size:
+                    # blocks while the rows already generated are not sent
+                    results.put((task_id, rows))
+                    rows = []
+                    if cancelled[task_id % cancelled_size] == task_id:
+                        break
+        except Exception as e:
+            rows.append({"student": request.get("program", "source"), "error": str(e)})
+        results.put((task_id, rows))
+        # the end of the request
+        results.put((task_id, None))
+
+#-----------------------------------------------------------------
+# A bounded pool of worker processes. The rows of each request are sent back to the thread that submitted it through its own queue.
+# Every queue is bounded, so the workers wait for the clients that read the rows slowly. The requests of the clients that disconnect are cancelled.
+class WorkerPool:
+
+    def __init__ (self, num_workers, max_programs):
+        if num_workers == 0:
+            num_workers = os.cpu_count()
+        self.tasks = [multiprocessing.Queue(queue_size) for _ in range(num_workers)]
+        self.results = multiprocessing.Queue(queue_size)
+        # the id of each request cancelled is kept in its slot, until it is overwritten by a request cancelled much later
+        self.cancelled = multiprocessing.Array('q', [-1]*cancelled_size, lock=False)
+        self.workers = [multiprocessing.Process(target=worker_loop, args=(t, self.results, self.cancelled, max_programs), daemon=True) for t in self.tasks]
+        for w in self.workers:
+            w.start()
+        self.streams = dict()
+        self.lock = threading.Lock()
+        self.next_id = 0
+        threading.Thread(target=self.dispatch, daemon=True).start()
+
+    def submit(self, request, source, stream, index):
+        # the rows of the request are put in stream, as pairs with the index of the request in its batch. Returns the id of the request.
+        w = int(hashlib.sha1(source.encode()).hexdigest(), 16) % len(self.tasks)
+        with self.lock:
+            task_id = self.next_id
+            self.next_id += 1
+            self.streams[task_id] = [stream, index, False]
+        # blocks while the worker has too many requests waiting
+        self.tasks[w].put((task_id, request, source))
+        return task_id
+
+    def cancel(self, task_id):
+        with self.lock:
+            if task_id in self.streams:
+                self.streams[task_id][2] = True
+                self.cancelled[task_id % cancelled_size] = task_id
+
+    def dispatch(self):
+        while True:
+            task_id, rows = self.results.get()
+            with self.lock:
+                entry = self.streams[task_id]
+            # waits for the client to read the rows, the rows of the cancelled requests are dropped
+            while not entry[2]:
+                try:
+                    entry[0].put((entry[1], rows), timeout=0.1)
+                    break
+                except queue.Full:
+                    pass
+            if rows is None:
+                with self.lock:
+                    del self.streams[task_id]
+
+    def close(self):
+        for t in self.tasks:
+            t.put(None)
+
+#-----------------------------------------------------------------
+
+class AugmentationHandler(BaseHTTPRequestHandler):
+
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self):
+        # the ids of the programs of the input directory
+        self.send_json(200, sorted(self.server.programs.keys()))
+
+    def do_POST(self):
+        # the body is a request or a list of requests (a batch), e.g. {"program": "123", "mutations": ["M1", "M3", "B2"], "num": 10, "seed": 1}.
+        # The programs can also be given by their code ("source"). The rows of the programs are streamed as JSON Lines, as soon as they are generated.
+        try:
+            body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))))
+        except ValueError:
+            return self.send_json(400, {"error": "The body of the request is not valid JSON"})
+        batch = body if isinstance(body, list) else [body]
+        sources = []
+        for request in batch:
+            if not isinstance(request, dict):
+                return self.send_json(400, {"error": "Each request must be a JSON object"})
+            num = request.get("num", 1)
+            if not isinstance(num, int) or isinstance(num, bool) or num < 1 or num > max_num:
+                return self.send_json(400, {"error": "The number of programs (num) must be an integer from 1 to {m}".format(m=max_num)})
+            source = request.get("source", self.server.programs.get(request.get("program")))
+            if source is None:
+                return self.send_json(400, {"error": "Unknown program: {p}".format(p=request.get("program"))})
+            sources.append(source)
+        self.send_response(200)
+        self.send_header("Content-Type", "application/x-ndjson")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        stream = queue.Queue(stream_size)
+        # the requests are submitted by another thread, since submitting waits for the rows already generated to be sent
+        task_ids = []
+        lock = threading.Lock()
+        gone = threading.Event()
+        def submit_batch():
+            for i in range(len(batch)):
+                if gone.is_set():
+                    return
+                task_id = self.server.pool.submit(batch[i], sources[i], stream, i)
+                with lock:
+                    task_ids.append(task_id)
+                    if gone.is_set():
+                        self.server.pool.cancel(task_id)
+        threading.Thread(target=submit_batch, daemon=True).start()
+        try:
+            pending = len(batch)
+            while pending > 0:
+                index, rows = stream.get()
+                if rows is None:
+                    pending -= 1
+                elif rows != []:
+                    if len(batch) > 1:
+                        for row in rows:
+                            row["request"] = index
+                    self.send_chunk("".join(json.dumps(row) + "\n" for row in rows).encode())
+            self.send_chunk(b"")
+        except OSError:
+            # the client is gone, its requests are cancelled
+            with lock:
+                gone.set()
+                for task_id in task_ids:
+                    self.server.pool.cancel(task_id)
+            self.close_connection = True
+
+    def send_chunk(self, data):
+        self.wfile.write(b"%x\r\n%s\r\n" % (len(data), data))
+        self.wfile.flush()
+
+    def send_json(self, code, obj):
+        data = json.dumps(obj).encode()
+        self.send_response(code)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def address_string(self):
+        # the clients of the Unix socket have no address
+        return str(self.client_address[0]) if self.client_address else "unix"
+
+    def log_message(self, format, *log_args):
+        if self.server.verbose:
+            BaseHTTPRequestHandler.log_message(self, format, *log_args)
+
+class UnixHTTPServer(socketserver.ThreadingUnixStreamServer):
+
+    daemon_threads = True
+
+def load_programs(input_dir):
+    # the code of each program of the input directory, by the name of its file
+    programs = dict()
+    if input_dir is not None:
+        for p in sorted(pathlib.Path(input_dir).glob('*.c')):
+            programs[p.stem] = p.read_text()
+    return programs
+
+def serve(args):
+    pool = WorkerPool(args.jobs, args.max_programs)
+    if args.socket is not None:
+        if os.path.exists(args.socket):
+            os.remove(args.socket)
+        server = UnixHTTPServer(args.socket, AugmentationHandler)
+        address = args.socket
+    else:
+        server = ThreadingHTTPServer(("127.0.0.1", args.port), AugmentationHandler)
+        address = "http://127.0.0.1:{p}".format(p=server.server_address[1])
+    server.pool = pool
+    server.programs = load_programs(args.input_dir)
+    server.verbose = args.verbose
+    print("Serving {n} programs on {a}".format(n=len(server.programs), a=address), flush=True)
+    # the server stops in the same way with Ctrl-C and with kill
+    signal.signal(signal.SIGTERM, signal.default_int_handler)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    server.server_close()
+    pool.close()
+    if args.socket is not None and os.path.exists(args.socket):
+        os.remove(args.socket)
+
+#-----------------------------------------------------------------
+
+def parser():
+    parser = argparse.ArgumentParser(prog='augmentation_server.py', formatter_class=argparse.RawTextHelpFormatter)
+    parser.add_argument('-d', '--input_dir', help='Name of the directory with the programs served by their name (without the .c). Other programs can be sent in the requests.')
+    parser.add_argument('-p', '--port', type=int, default=8000, help='Port of the server, on localhost. (Default = 8000).')
+    parser.add_argument('-u', '--socket', help='Path of a Unix socket to serve on, instead of the port.')
+    parser.add_argument('-j', '--jobs', type=int, default=1, help='Number of worker processes generating the programs. Use 0 for one worker per core. (Default = 1).')
+    parser.add_argument('-m', '--max_programs', type=int, default=1000, help='Maximum number of analysed programs kept in memory by each worker. (Default = 1000).')
+    parser.add_argument('-v', '--verbose', action='store_true', default=False, help='Prints the requests received.')
+    args = parser.parse_args(argv[1:])
+    return args
+
+if __name__ == "__main__":
+    args = parser()
+    serve(args)
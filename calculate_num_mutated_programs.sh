@@ -23,6 +23,18 @@ fi
 
 years=()
 
+# number of exercises processed at the same time, each one by a single python process
+max_jobs=$(nproc)
+
+run_bounded(){
+    # runs the command in the background, after waiting for one of the running commands to finish if there are already $max_jobs running
+    while [[ $(jobs -rp | wc -l) -ge $max_jobs ]];
+    do
+	wait -n
+    done
+    "$@" &
+}
+
 # mutations=("swap_if_else_sttms" "decl_dummy_vars")
 # mutations_flags=("-if" "-dv")
 # labs=("lab02")
@@ -78,7 +90,7 @@ mutate_ex_programs(){
 	local mut1=${mutations[$m1]}
 	local f1=${mutations_flags[$m1]}
 	# echo $mut1
-	local n_mutations=$(python prog_mutator.py -d $ex_dir -o $out_dir/$mut1 $f1 -ea -info)
+	local n_mutations=$(python prog_mutator.py -d $ex_dir -o $out_dir/$mut1 $f1 -ea -info -j 1)
 	echo $info/$mut1","$n_mutations  | tee -a $output_file | tee -a results_csvs/$dataset-$year-$lab.txt | tee -a results_csvs/$dataset-$year.txt
 	# local n_mutations=$(print_info $out_dir/$mut1 $info/$mut1)
 	local n_mutations=$((n_mutations))
@@ -89,7 +101,7 @@ mutate_ex_programs(){
 	#     local mut2=${mutations[$m2]}
 	#     local f2=${mutations_flags[$m2]}
 	#     # echo $mut1-$mut2
-	#     local n_mutations=$(python prog_mutator.py -d $ex_dir -o $out_dir/$mut1-$mut2 $f1 $f2 -ea -info)
+	#     local n_mutations=$(python prog_mutator.py -d $ex_dir -o $out_dir/$mut1-$mut2 $f1 $f2 -ea -info -j 1)
 	#     echo $info/$mut1-$mut2","$n_mutations >> $output_file
 	#     # local n_mutations=$(print_info $out_dir/$mut1-$mut2 $info/$mut1-$mut2)
 	#     local n_mutations=$((n_mutations))
@@ -100,7 +112,7 @@ mutate_ex_programs(){
 	# 	local mut3=${mutations[$m3]}
 	# 	local f3=${mutations_flags[$m3]}
 	# 	# echo $mut1-$mut2-$mut3
-	# 	local n_mutations=$(python prog_mutator.py -d $ex_dir -o $out_dir/$mut1-$mut2-$mut3 $f1 $f2 $f3 -ea -info)
+	# 	local n_mutations=$(python prog_mutator.py -d $ex_dir -o $out_dir/$mut1-$mut2-$mut3 $f1 $f2 $f3 -ea -info -j 1)
 	# 	echo $info/$mut1-$mut2-$mut3","$n_mutations >> $output_file
 	# 	#local n_mutations=$(print_info $out_dir/$mut1-$mut2-$mut3 $info/$mut1-$mut2-$mut3)
 	# 	local n_mutations=$((n_mutations))
@@ -111,7 +123,7 @@ mutate_ex_programs(){
 	# 	    local mut4=${mutations[$m4]}
 	# 	    local f4=${mutations_flags[$m4]}
 	# 	    # echo $mut1-$mut2-$mut3-$mut4
-	# 	    local n_mutations=$(python prog_mutator.py -d $ex_dir -o $out_dir/$mut1-$mut2-$mut3-$mut4 $f1 $f2 $f3 $f4 -ea -info)
+	# 	    local n_mutations=$(python prog_mutator.py -d $ex_dir -o $out_dir/$mut1-$mut2-$mut3-$mut4 $f1 $f2 $f3 $f4 -ea -info -j 1)
 	# 	    echo $info/$mut1-$mut2-$mut3$mut4","$n_mutations >> $output_file
 	# 	    # local n_mutations=$(print_info $out_dir/$mut1-$mut2-$mut3-$mut4 $info/$mut1-$mut2-$mut3-$mut4)
 	# 	    local n_mutations=$((n_mutations))
@@ -122,7 +134,7 @@ mutate_ex_programs(){
 	# 		local mut5=${mutations[$m5]}
 	# 		local f5=${mutations_flags[$m5]}
 	# 		# echo $mut1-$mut2-$mut3-$mut4-$mut5
-	# 		local n_mutations=$(python prog_mutator.py -d $ex_dir -o $out_dir/$mut1-$mut2-$mut3-$mut4-$mut5 $f1 $f2 $f3 $f4 $f5 -ea -info)
+	# 		local n_mutations=$(python prog_mutator.py -d $ex_dir -o $out_dir/$mut1-$mut2-$mut3-$mut4-$mut5 $f1 $f2 $f3 $f4 $f5 -ea -info -j 1)
 	# 		echo $info/$mut1-$mut2-$mut3$mut4-$mut5","$n_mutations >> $output_file
 	# 		# local n_mutations=$(print_info  $data_dir/$sub_type/$year/$lab/$ex/$mut1-$mut2-$mut3-$mut4-$mut5 $info/$mut1-$mut2-$mut3-$mut4-$mut5)
 	# 		local n_mutations=$((n_mutations))
@@ -133,7 +145,7 @@ mutate_ex_programs(){
 	# 		    local mut6=${mutations[$m6]}
 	# 		    local f6=${mutations_flags[$m6]}
 	# 		    # echo $mut1-$mut2-$mut3-$mut4-$mut5
-	# 		    local n_mutations=$(python prog_mutator.py -d $ex_dir -o $out_dir/$mut1-$mut2-$mut3-$mut4-$mut5-$mut6 $f1 $f2 $f3 $f4 $f5 $f6 -ea -info)
+	# 		    local n_mutations=$(python prog_mutator.py -d $ex_dir -o $out_dir/$mut1-$mut2-$mut3-$mut4-$mut5-$mut6 $f1 $f2 $f3 $f4 $f5 $f6 -ea -info -j 1)
 	# 		    echo $info/$mut1-$mut2-$mut3$mut4-$mut5-$mut6","$n_mutations >> $output_file
 	# 		    # local n_mutations=$(print_info $out_dir/$mut1-$mut2-$mut3-$mut4-$mut5-$mut6 $info/$mut1-$mut2-$mut3-$mut4-$mut5-$mut6)
 	# 		    local n_mutations=$((n_mutations))
@@ -158,9 +170,8 @@ mutate_lab_programs(){
     do
 	ex=$(echo $ex | rev | cut -d '/' -f 1 | rev)
 	mkdir -p  $data_dir/$sub_type/$year/$lab/$ex
-	mutate_ex_programs  $lab_dir/$ex $data_dir/$sub_type/$year/$lab/$ex $year/$lab/$ex $year $lab $ex &
+	run_bounded mutate_ex_programs  $lab_dir/$ex $data_dir/$sub_type/$year/$lab/$ex $year/$lab/$ex $year $lab $ex
     done
-    wait
 }
 
 mutate_programs(){
@@ -174,9 +185,8 @@ mutate_programs(){
     do
 	lab=${labs[$l]}
 	echo "" > results_csvs/$dataset-$year-$lab.txt
-	mutate_lab_programs $sub_dir/$year/$lab $year $lab $sub_type  &
+	mutate_lab_programs $sub_dir/$year/$lab $year $lab $sub_type
     done
-    wait
 }
 
 echo "Starting program mutation..."
@@ -184,5 +194,6 @@ for((y=0;y<${#years[@]};y++));
 do
     ys=${years[$y]}
     echo "" > results_csvs/$dataset-$ys.txt
-    mutate_programs $ys $dataset/correct_submissions &
+    mutate_programs $ys $dataset/correct_submissions
 done
+wait
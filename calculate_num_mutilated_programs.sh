@@ -21,6 +21,18 @@ fi
 
 years=()
 
+# number of exercises processed at the same time, each one by a single python process
+max_jobs=$(nproc)
+
+run_bounded(){
+    # runs the command in the background, after waiting for one of the running commands to finish if there are already $max_jobs running
+    while [[ $(jobs -rp | wc -l) -ge $max_jobs ]];
+    do
+	wait -n
+    done
+    "$@" &
+}
+
 for y in $(find $dataset/correct_submissions/* -maxdepth 0 -type d);
 do
     y=$(echo $y | rev | cut -d '/' -f 1 | rev)
@@ -52,7 +64,7 @@ mutilate_ex_programs(){
 	local mut1=${mutilations[$m1]}
 	local f1=${mutilations_flags[$m1]}
 	# echo $mut1
-	local n_mutilations=$(python prog_mutilator.py -d $ex_dir -o $out_dir/$mut1 $f1 -info)
+	local n_mutilations=$(python prog_mutilator.py -d $ex_dir -o $out_dir/$mut1 $f1 -info -j 1)
 	echo $info/$mut1","$n_mutilations  | tee -a $output_file | tee -a results_csvs/mutilations/$dataset-$year-$lab.txt | tee -a results_csvs/mutilations/$dataset-$year.txt
 	local n_mutilations=$((n_mutilations))
 	num_mut_progs_ex=$((num_mut_progs_ex+n_mutilations))
@@ -71,9 +83,8 @@ mutilate_lab_programs(){
     do
 	ex=$(echo $ex | rev | cut -d '/' -f 1 | rev)
 	mkdir -p  $data_dir/$sub_type/$year/$lab/$ex
-	mutilate_ex_programs  $lab_dir/$ex $data_dir/$sub_type/$year/$lab/$ex $year/$lab/$ex $year $lab $ex &
+	run_bounded mutilate_ex_programs  $lab_dir/$ex $data_dir/$sub_type/$year/$lab/$ex $year/$lab/$ex $year $lab $ex
     done
-    wait
 }
 
 mutilate_programs(){
@@ -87,9 +98,8 @@ mutilate_programs(){
     do
 	lab=${labs[$l]}
 	echo "" > results_csvs/mutilations/$dataset-$year-$lab.txt
-	mutilate_lab_programs $sub_dir/$year/$lab $year $lab $sub_type  &
+	mutilate_lab_programs $sub_dir/$year/$lab $year $lab $sub_type
     done
-    wait
 }
 
 echo "Starting program mutation..."
@@ -97,5 +107,6 @@ for((y=0;y<${#years[@]};y++));
 do
     ys=${years[$y]}
     echo "" > results_csvs/mutilations/$dataset-$ys.txt
-    mutilate_programs $ys $dataset/correct_submissions &
+    mutilate_programs $ys $dataset/correct_submissions
 done
+wait
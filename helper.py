@@ -21,61 +21,193 @@ from numpy import binary_repr
 import pickle
 import gzip
 import pathlib
+import multiprocessing
+import hashlib
+import io
+import queue
+import threading
+import subprocess
+import json
+import shutil
+import zipfile
+import difflib
+import zlib
 # This is not required if you've installed pycparser into
 # your site-packages/ with setup.py
 sys.path.extend(['.', '..'])
 
+import pycparser
 from pycparser import c_parser, c_ast, parse_file, c_generator
 
 #-----------------------------------------------------------------
 
-id_dict = dict()
-cur_id = 0
+# Integer ids of the nodes of a program. The nodes of each kind (e.g. "If", "Compound") are numbered in the order they are visited,
+# so every visitor that traverses a copy of the same AST gives the same id to the same node, without any state shared between programs.
+class NodeIds:
 
-def reset_ids():
-    global id_dict, cur_id
-    id_dict = dict()
-    cur_id = 0    
+    def __init__ (self):
+        self.counters = dict()
 
-def node_id(coord, t=""):
-    global id_dict
-    global cur_id
-    file = coord.file
-    line = coord.line
-    column = coord.column
-    s = file+str(line)+str(column)+str(t)
-    # print('node_id')
-    # print(s)
-    # print(id_dict)
-    if s in id_dict.keys():
-        return id_dict[s]
-    else:
-        id_dict[s] = cur_id
-        cur_id += 1        
-        return id_dict[s]
+    def next_id(self, kind):
+        # the id the next node of this kind will get
+        return self.counters.get(kind, 0)
+
+    def new_id(self, kind):
+        i = self.counters.get(kind, 0)
+        self.counters[kind] = i+1
+        return i
+
+# The sites of each mutation of a program i.e. the ids of the nodes where the mutation can be applied, built once while the program is analysed.
+# The sites are kept in the order they were found, and in a set to check if a node is a site in constant time.
+class SiteIndex:
+
+    def __init__ (self):
+        self.sites = dict()
+        self.sites_set = dict()
+
+    def add_site(self, mutation, node_id):
+        if mutation not in self.sites.keys():
+            self.sites[mutation] = []
+            self.sites_set[mutation] = set()
+        self.sites[mutation].append(node_id)
+        self.sites_set[mutation].add(node_id)
+
+    def get_sites(self, mutation):
+        return self.sites.get(mutation, [])
+
+    def num_sites(self, mutation):
+        return len(self.get_sites(mutation))
+
+    def is_site(self, mutation, node_id):
+        return mutation in self.sites_set.keys() and node_id in self.sites_set[mutation]
 
 def node_repr(coord):
     file = coord.file
     line = coord.line
     column = coord.column
     return "l"+str(line)+"-c"+str(column)
-    
+
+def copy_ast(node, origins=None):
+    # Structural copy of a pycparser AST, much cheaper than deepcopy.
+    # Every node and every child list is duplicated, so the visitors can freely modify the copy in place,
+    # but the coords and the leaf values (names, operators, constants) are shared with the original AST.
+    # origins (if given) maps the id of each node of the copy to the node and the original node. The nodes are kept in origins,
+    # so their ids are not reused by other nodes even if the visitors replace them.
+    if isinstance(node, list):
+        return [copy_ast(x, origins) for x in node]
+    if not isinstance(node, c_ast.Node):
+        return node
+    n_node = node.__class__.__new__(node.__class__)
+    # the last two slots of every pycparser node are 'coord' and '__weakref__'
+    for attr in node.__slots__[:-2]:
+        setattr(n_node, attr, copy_ast(getattr(node, attr), origins))
+    n_node.coord = node.coord
+    if origins is not None:
+        origins[id(n_node)] = (n_node, node)
+    return n_node
+
 #-----------------------------------------------------------------
-def make_output_dir(input_file, output_dir):
+def run_jobs(func, items, num_jobs, initializer=None, initargs=()):
+    # Applies func to each item using at most num_jobs worker processes (all the cores if num_jobs is 0).
+    # The results are yielded in the same order as the items, so the callers can report their progress deterministically.
+    if num_jobs == 0:
+        num_jobs = os.cpu_count()
+    if num_jobs <= 1 or len(items) <= 1:
+        for x in items:
+            yield func(x)
+        return
+    with multiprocessing.Pool(min(num_jobs, len(items)), initializer, initargs) as pool:
+        for r in pool.imap(func, items):
+            yield r
+
+#-----------------------------------------------------------------
+# A journal of the programs already processed in an output directory, so that interrupted runs can be resumed.
+# Each line records the hash of a program, the arguments used (including the seed), the files produced and the numbers of programs counted
+# (-info) and of duplicated programs skipped (-dd) while processing it.
+# A program is processed again if any of these changed or if some of its files are missing.
+
+def file_hash(input_file):
+    with open(input_file, 'rb') as reader:
+        return hashlib.sha1(reader.read()).hexdigest()
+
+def get_run_flags(args):
+    # the arguments that change the programs generated
+    ignored = ["input_dir", "output_dir", "jobs", "verbose", "cache_dir", "cache_size"]
+    return {k: v for k, v in sorted(vars(args).items()) if k not in ignored}
+
+def get_program_random(args, input_file, source=None):
+    # the random generator of a program. Each program has its own seed, so the programs generated do not depend on the programs processed
+    # before it, and the state of the random module (e.g. of the callers of the library) is left untouched.
+    # The programs given as strings (source) are seeded with the hash of their code, the same as the file with that code.
+    # Without a seed, the programs are drawn from the shared generator of the random module.
+    if args.seed is None:
+        return random
+    h = file_hash(input_file) if source is None else hashlib.sha1(source.encode()).hexdigest()
+    return random.Random("{s}-{h}".format(s=args.seed, h=h))
+
+class Manifest:
+
+    def __init__ (self, output_dir, flags):
+        self.file_name = output_dir + '/manifest.jsonl'
+        self.flags = flags
+        self.entries = dict()
+        if os.path.exists(self.file_name):
+            with open(self.file_name, 'r') as reader:
+                for line in reader:
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        # the last line of an interrupted run
+                        continue
+                    self.entries[entry["program"]] = entry
+
+    def get_entry(self, program, input_hash, prog_dir):
+        # returns None if the program was not processed with the same input and arguments, or if some of its files were removed
+        entry = self.entries.get(program)
+        if entry is None or entry["input"] != input_hash or entry["flags"] != self.flags:
+            return None
+        # the entries written by older versions, with a single count for both
+        if "num_progs" not in entry or "duplicates" not in entry:
+            return None
+        for f in entry["files"]:
+            if not os.path.exists(prog_dir + '/' + f):
+                return None
+        return entry
+
+    def add_entry(self, program, input_hash, prog_dir, num_progs, num_duplicates):
+        files = sorted(os.listdir(prog_dir)) if os.path.isdir(prog_dir) else []
+        entry = {"program": program, "input": input_hash, "flags": self.flags, "files": files, "num_progs": num_progs, "duplicates": num_duplicates}
+        self.entries[program] = entry
+        if not os.path.exists(os.path.dirname(self.file_name)):
+            os.makedirs(os.path.dirname(self.file_name), exist_ok=True)
+        with open(self.file_name, 'a') as writer:
+            writer.write(json.dumps(entry) + "\n")
+
+#-----------------------------------------------------------------
+def split_includes(lines):
+    # the system includes, the other includes and the remaining lines of a program
     sincludes = []
     includes = []
     noincludes = []
-    with open(input_file, 'r') as reader:
-        for line in reader:
-            m = re.match('^\s*#\s*include\s*<', line)
+    for line in lines:
+        m = re.match('^\s*#\s*include\s*<', line)
+        if m:
+            sincludes.append(line)
+        else:
+            m = re.match('^\s*#\s*include', line)
             if m:
-                sincludes.append(line)
+                includes.append(line)
             else:
-                m = re.match('^\s*#\s*include', line)
-                if m:
-                    includes.append(line)
-                else:
-                    noincludes.append(line)
+                noincludes.append(line)
+    return sincludes, includes, noincludes
+
+def get_program_code(sincludes, includes, noincludes):
+    # the code given to the parser, with the fakestart function separating the includes from the program
+    return "".join(sincludes) + "".join(includes) + 'void fakestart() {;}\n' + "".join(noincludes)
+
+def make_output_dir(input_file, output_dir):
+    with open(input_file, 'r') as reader:
+        sincludes, includes, noincludes = split_includes(reader)
     try:
         if not os.path.exists(output_dir):
             os.makedirs(output_dir)
@@ -85,24 +217,287 @@ def make_output_dir(input_file, output_dir):
     # output_file = output_dir + '/' + os.path.basename(input_file)
     output_file = output_dir + '/tmp_input_file.c'
     with open(output_file, 'w') as writer:
-        writer.writelines(sincludes)
-        writer.writelines(includes)
-        writer.write('void fakestart() {;}\n')
-        writer.writelines(noincludes)
+        writer.write(get_program_code(sincludes, includes, noincludes))
 
     return output_file, sincludes, includes
 
-def get_output_file_name(filename, output_dir):
-    return output_dir + '/' + filename + ".c"
-    
-def gen_output_file(c_gen, ast, includes, filename, output_dir):
-    output_file = get_output_file_name(filename, output_dir)
-    str_ast = c_gen.visit(ast)
-    # print(str_ast)
-    # str_ast = remove_fakestart(str_ast)
-    with open(output_file, 'w') as writer:
-        writer.writelines(includes)
-        writer.write(str_ast)
+def write_output_file(str_ast, includes, filename, sink, mutations=None):
+    sink.add_program(filename, "".join(includes) + str_ast, mutations)
+
+#-----------------------------------------------------------------
+# Where the programs generated and their mappings are written. Each program is added to the sink followed by its mappings (e.g. "var_map").
+# DirectorySink writes one file each in the output directory. ArchiveSink writes a single zip archive per output directory, which is only
+# appended to and whose members can be read in any order. The members of the archive have the same names and contents as the files,
+# so extracting the archive gives the same directory. DatasetSink writes a single gzipped JSON Lines file per output directory,
+# with a row per program. PatchSink writes the original program once, and the rows of each program with its edits to the original
+# program (see get_patch) instead of its code.
+# The programs skipped for being the same as a program already generated are added as aliases of that program.
+# The file sinks can also write the variable mappings to a single file per output directory (var_maps_name), with each distinct mapping
+# stored once and the index of its mapping for the name of the file of each mapping.
+
+archive_name = 'programs.zip'
+dataset_name = 'dataset.jsonl.gz'
+patches_name = 'patches.jsonl.gz'
+original_name = 'original.c'
+var_maps_name = 'var_maps.json.gz'
+aliases_name = 'aliases.json'
+
+class FileSink:
+
+    def __init__ (self, var_maps=False):
+        self.aliases = dict()
+        # the distinct variable mappings, with the index of each one, and the index of the mapping of each file
+        self.var_maps = dict() if var_maps else None
+        self.var_maps_index = dict()
+
+    def add_program(self, filename, str_prog, mutations):
+        self.write(filename + ".c", str_prog)
+
+    def add_mapping(self, kind, filename, mapping):
+        if kind == "var_map" and self.var_maps is not None:
+            self.var_maps_index[filename] = self.var_maps.setdefault(tuple(mapping.items()), len(self.var_maps))
+        else:
+            self.write(filename, gzip.compress(pickle.dumps(mapping)))
+
+    def add_alias(self, filename, original, mutations):
+        self.aliases[filename] = original
+
+    def close(self):
+        if self.aliases != dict():
+            self.write(aliases_name, json.dumps(self.aliases))
+        if self.var_maps:
+            var_maps = [dict(m) for m in self.var_maps.keys()]
+            self.write(var_maps_name, gzip.compress(json.dumps({"var_maps": var_maps, "index": self.var_maps_index}).encode()))
+
+class DirectorySink(FileSink):
+
+    def __init__ (self, output_dir, var_maps=False):
+        super().__init__(var_maps)
+        self.output_dir = output_dir
+
+    def write(self, filename, data):
+        with open(self.output_dir + '/' + filename, 'wb' if isinstance(data, bytes) else 'w') as writer:
+            writer.write(data)
+
+class ArchiveSink(FileSink):
+
+    def __init__ (self, output_dir, var_maps=False):
+        super().__init__(var_maps)
+        self.archive = zipfile.ZipFile(output_dir + '/' + archive_name, 'a')
+
+    def write(self, filename, data):
+        # the mappings are already gzipped
+        compression = zipfile.ZIP_STORED if filename.endswith('.gz') else zipfile.ZIP_DEFLATED
+        self.archive.writestr(filename, data, compress_type=compression)
+
+    def close(self):
+        super().close()
+        self.archive.close()
+
+class DatasetSink:
+
+    # number of rows kept in memory before being written
+    batch_size = 1000
+    file_name = dataset_name
+
+    def __init__ (self, output_dir):
+        self.student = os.path.basename(os.path.normpath(output_dir))
+        self.writer = gzip.open(output_dir + '/' + self.file_name, 'wt')
+        self.rows = []
+
+    def add_program(self, filename, str_prog, mutations):
+        if len(self.rows) >= self.batch_size:
+            self.flush()
+        self.rows.append({"student": self.student, "program": filename, "mutations": mutations, "source": str_prog})
+
+    def add_mapping(self, kind, filename, mapping):
+        self.rows[-1][kind] = mapping
+
+    def add_alias(self, filename, original, mutations):
+        if len(self.rows) >= self.batch_size:
+            self.flush()
+        self.rows.append({"student": self.student, "program": filename, "mutations": mutations, "alias_of": original})
+
+    def flush(self):
+        self.writer.writelines(json.dumps(row) + "\n" for row in self.rows)
+        self.rows = []
+
+    def close(self):
+        self.flush()
+        self.writer.close()
+
+class PatchSink(DatasetSink):
+
+    file_name = patches_name
+
+    def __init__ (self, output_dir, original):
+        super().__init__(output_dir)
+        self.original = original
+        self.original_lines = original.splitlines(keepends=True)
+        with open(output_dir + '/' + original_name, 'w') as writer:
+            writer.write(original)
+
+    def add_program(self, filename, str_prog, mutations):
+        super().add_program(filename, str_prog, mutations)
+        self.rows[-1]["patch"] = get_patch(self.original, str_prog, self.original_lines)
+        del self.rows[-1]["source"]
+
+# A sink that writes to another sink in a background thread, so the programs are generated while the previous ones (and their
+# compressed mappings) are being written. The calls wait in a bounded queue, so the generation of the programs waits for the
+# writer when it falls behind, and the programs waiting to be written never take more than a fixed amount of memory.
+class BackgroundSink:
+
+    # the calls are handed to the writer in batches, and at most queue_size batches wait to be written
+    batch_size = 32
+    queue_size = 8
+
+    def __init__ (self, sink):
+        self.sink = sink
+        self.batches = queue.Queue(self.queue_size)
+        self.calls = []
+        # the first error of the writer, raised by the next call
+        self.error = None
+        self.writer = threading.Thread(target=self.write_calls, daemon=True)
+        self.writer.start()
+
+    def write_calls(self):
+        while True:
+            calls = self.batches.get()
+            if calls is None:
+                return
+            # after an error the calls are only consumed, so the generation never waits forever
+            for call in calls:
+                if self.error is None:
+                    try:
+                        call[0](*call[1:])
+                    except BaseException as e:
+                        self.error = e
+
+    def put(self, *call):
+        if self.error is not None:
+            raise self.error
+        self.calls.append(call)
+        if len(self.calls) >= self.batch_size:
+            self.batches.put(self.calls)
+            self.calls = []
+
+    def add_program(self, filename, str_prog, mutations):
+        self.put(self.sink.add_program, filename, str_prog, mutations)
+
+    def add_mapping(self, kind, filename, mapping):
+        self.put(self.sink.add_mapping, kind, filename, mapping)
+
+    def add_alias(self, filename, original, mutations):
+        self.put(self.sink.add_alias, filename, original, mutations)
+
+    def close(self):
+        self.put(self.sink.close)
+        self.batches.put(self.calls)
+        self.batches.put(None)
+        self.writer.join()
+        if self.error is not None:
+            raise self.error
+
+# The programs already generated for a student, by the hash of their code.
+class DuplicateFilter:
+
+    def __init__ (self):
+        self.programs = dict()
+        self.num_duplicates = 0
+
+    def get_original(self, filename, str_prog):
+        # returns the name of the first program with the same code, or None if there is none
+        key = hashlib.sha1(str_prog.encode()).hexdigest()
+        if key in self.programs:
+            self.num_duplicates += 1
+            return self.programs[key]
+        self.programs[key] = filename
+        return None
+
+def get_output_sink(output_dir, args, original=None):
+    # original is the code of the original program, the programs are written as their edits to it with args.patches
+    if args.patches:
+        sink = PatchSink(output_dir, original)
+    elif args.dataset:
+        sink = DatasetSink(output_dir)
+    elif args.archive:
+        sink = ArchiveSink(output_dir, args.var_maps)
+    else:
+        sink = DirectorySink(output_dir, args.var_maps)
+    return BackgroundSink(sink)
+
+def get_patch(original, str_prog, original_lines=None):
+    # The edits that turn the original program into str_prog, as a list of [start, end, text]: the characters of the original program
+    # from start to end are replaced by text. The lines that differ are found first, and then only the characters that differ in those lines.
+    if original_lines is None:
+        original_lines = original.splitlines(keepends=True)
+    prog_lines = str_prog.splitlines(keepends=True)
+    offsets = [0]
+    for l in original_lines:
+        offsets.append(offsets[-1] + len(l))
+    patch = []
+    for tag, i1, i2, j1, j2 in difflib.SequenceMatcher(None, original_lines, prog_lines, autojunk=False).get_opcodes():
+        if tag == 'equal':
+            continue
+        old = original[offsets[i1]:offsets[i2]]
+        new = "".join(prog_lines[j1:j2])
+        prefix = len(os.path.commonprefix([old, new]))
+        suffix = len(os.path.commonprefix([old[prefix:][::-1], new[prefix:][::-1]]))
+        patch.append([offsets[i1] + prefix, offsets[i2] - suffix, new[prefix:len(new)-suffix]])
+    return patch
+
+def apply_patch(original, patch):
+    # the code of a program given its edits to the original program (see get_patch)
+    parts = []
+    last = 0
+    for start, end, text in patch:
+        parts.append(original[last:start])
+        parts.append(text)
+        last = end
+    parts.append(original[last:])
+    return "".join(parts)
+
+def read_patched_programs(output_dir):
+    # Generator of the programs written by PatchSink in output_dir, as their rows with their code (source).
+    # The rows of the programs skipped as duplicates get the code of their original program.
+    with open(output_dir + '/' + original_name, 'r') as reader:
+        original = reader.read()
+    programs = dict()
+    with gzip.open(output_dir + '/' + patches_name, 'rt') as reader:
+        for line in reader:
+            row = json.loads(line)
+            if "alias_of" in row:
+                row["source"] = programs[row["alias_of"]]
+            else:
+                row["source"] = apply_patch(original, row.pop("patch"))
+                programs[row["program"]] = row["source"]
+            yield row
+
+def read_output_file(output_dir, filename):
+    # reads a file written by any of the sinks, as bytes
+    if os.path.exists(output_dir + '/' + archive_name):
+        with zipfile.ZipFile(output_dir + '/' + archive_name, 'r') as archive:
+            return archive.read(filename)
+    with open(output_dir + '/' + filename, 'rb') as reader:
+        return reader.read()
+
+def read_var_maps(output_dir):
+    # the variable mappings written by a file sink, by the name of the file of each mapping (the files, or the single file of the mappings)
+    try:
+        store = json.loads(gzip.decompress(read_output_file(output_dir, var_maps_name)))
+        return {filename : store["var_maps"][i] for filename, i in store["index"].items()}
+    except (FileNotFoundError, KeyError):
+        pass
+    var_maps = dict()
+    if os.path.exists(output_dir + '/' + archive_name):
+        with zipfile.ZipFile(output_dir + '/' + archive_name, 'r') as archive:
+            names = archive.namelist()
+    else:
+        names = os.listdir(output_dir)
+    for filename in sorted(names):
+        if filename.startswith('var_map-'):
+            var_maps[filename] = pickle.loads(gzip.decompress(read_output_file(output_dir, filename)))
+    return var_maps
 
 def write_program(ast, c_gen, output_file, includes):
     # write a clean program without any fakestart info
@@ -129,6 +524,336 @@ def check_program(tmp_file, ipa):
             return False
         return True
 
+#-----------------------------------------------------------------
+# Parsing of the programs without calling the preprocessor for each one of them.
+# The headers are preprocessed once per set of includes and reused by every program with the same includes. The parser only needs the names
+# of their typedefs, and the names of their macros tell which programs can skip the preprocessor. The other programs are the ones with
+# preprocessor directives or comments spanning several lines. Their code is handed to gcc as before.
+
+cpp_args = ['-E', '-I'+os.path.join(os.path.dirname(os.path.abspath(__file__)), 'utils', 'fake_libc_include')]
+# the macro and typedef names of each set of includes
+headers_cache = dict()
+# parser reused by every parse
+shared_parser = None
+
+identifier_re = re.compile(r"[A-Za-z_][A-Za-z0-9_]*")
+pp_number_re = re.compile(r"\.?[0-9](?:[eEpP][+-]|[A-Za-z0-9_.])*")
+
+def get_parser():
+    global shared_parser
+    if shared_parser is None:
+        shared_parser = c_parser.CParser()
+    return shared_parser
+
+def preprocess_source(code, extra_args=[]):
+    # the same as preprocess_file, for code that is not in a file (gcc reads it from its standard input)
+    return subprocess.run(['gcc'] + cpp_args + extra_args + ['-x', 'c', '-'], input=code, stdout=subprocess.PIPE,
+                          stderr=subprocess.DEVNULL, universal_newlines=True, check=True).stdout
+
+def preprocess_headers(sincludes):
+    # returns the names of the macros and of the typedefs declared by the headers, or None if the headers can not be preprocessed
+    key = "".join(sincludes)
+    if key not in headers_cache:
+        try:
+            defines = preprocess_source(key, ['-dM'])
+            macro_names = set(re.findall(r"^#define ([A-Za-z_][A-Za-z0-9_]*)", defines, re.M))
+            ast = get_parser().parse(preprocess_source(key), "<headers>")
+            typedef_names = set(x.name for x in ast.ext if isinstance(x, c_ast.Typedef))
+            headers_cache[key] = (macro_names, typedef_names)
+        except:
+            headers_cache[key] = None
+    return headers_cache[key]
+
+def preprocess_code(lines, macro_names):
+    # The preprocessed code of a program without directives nor macros is its own code, with each run of whitespace and comments
+    # between two tokens replaced by a single space and each line indented to the column of its first token, like gcc does.
+    # The tokens after a comment spanning several lines are placed in the line where the comment ends.
+    # Returns None if the code needs the preprocessor.
+    p_lines = []
+    in_comment = False
+    for line in lines:
+        line = line.rstrip("\n")
+        if line.endswith("\r"):
+            line = line[:-1]
+        if line.endswith("\\") or "\r" in line or "\f" in line or "\v" in line:
+            return None
+        p_line = []
+        space = False
+        i = 0
+        if in_comment:
+            j = line.find("*/")
+            if j == -1:
+                p_lines.append("")
+                continue
+            in_comment = False
+            i = j+2
+        while i < len(line):
+            c = line[i]
+            if c == " " or c == "\t":
+                space = True
+                i += 1
+                continue
+            if line.startswith("//", i):
+                break
+            if line.startswith("/*", i):
+                j = line.find("*/", i+2)
+                if j == -1:
+                    in_comment = True
+                    break
+                space = True
+                i = j+2
+                continue
+            if p_line == []:
+                p_line.append(" "*i)
+            elif space:
+                p_line.append(" ")
+            space = False
+            if c == '"' or c == "'":
+                j = i+1
+                while j < len(line) and line[j] != c:
+                    j += 2 if line[j] == "\\" else 1
+                if j >= len(line):
+                    return None
+                p_line.append(line[i:j+1])
+                i = j+1
+                continue
+            m = identifier_re.match(line, i) or pp_number_re.match(line, i)
+            if m:
+                if m.group() in macro_names:
+                    return None
+                p_line.append(m.group())
+                i = m.end()
+                continue
+            if c == "#":
+                return None
+            p_line.append(c)
+            i += 1
+        p_lines.append("".join(p_line))
+    if in_comment:
+        return None
+    return "\n".join(p_lines) + "\n"
+
+def parse_program(input_file, sincludes, includes, source=None):
+    # the same as parse_file(input_file, use_cpp=True, cpp_path='gcc', cpp_args=cpp_args) for the files written by make_output_dir.
+    # The programs that are not in a file are given as source (see get_program_code), and input_file is only the name used in their coords
+    headers = preprocess_headers(sincludes) if includes == [] else None
+    if headers is not None:
+        macro_names, typedef_names = headers
+        if source is None:
+            with open(input_file, 'r') as reader:
+                lines = reader.readlines()
+        else:
+            # only split at the newlines, like the files read by the parser
+            lines = io.StringIO(source).readlines()
+        code = preprocess_code(lines[len(sincludes):], macro_names)
+        if code is not None:
+            # the typedefs used by the program are declared before its code, their actual types do not matter to the parser
+            used_typedefs = typedef_names & set(identifier_re.findall(code))
+            prologue = "".join("typedef int {t};\n".format(t=t) for t in sorted(used_typedefs))
+            prologue += '# {l} "{f}"\n'.format(l=len(sincludes)+1, f=input_file)
+            try:
+                return get_parser().parse(prologue + code, input_file)
+            except:
+                pass
+    if source is not None:
+        return get_parser().parse(preprocess_source(source), input_file)
+    return parse_file(input_file, use_cpp=True, cpp_path='gcc', cpp_args=cpp_args)
+
+#-----------------------------------------------------------------
+# A persistent cache of the parsed programs and their analysis, indexed by the hash of the program's code and of the tool (namespace)
+# that analysed it, since the mutator and the mutilator store different analysis of the same program in the same directory.
+# Each entry is a gzipped pickle, and the least recently used entries are removed once the cache is larger than max_size bytes.
+# The size of the cache is computed once and then updated with the entries written, so the directory is only scanned again when the cache
+# is full (the entries are then removed until it is below low_water of max_size) or when a part of max_size was written since the last scan,
+# for the entries written by other processes.
+class AnalysisCache:
+
+    # the entries written by other versions of the code (ours or pycparser's) are never read
+    version = None
+    low_water = 0.9
+
+    def __init__ (self, cache_dir, max_size, namespace):
+        self.cache_dir = cache_dir
+        self.max_size = max_size
+        self.namespace = namespace
+        # the size of the cache (None until the directory is scanned), and the bytes written since it was scanned
+        self.size = None
+        self.written = 0
+        if AnalysisCache.version is None:
+            AnalysisCache.version = pycparser.__version__.encode()
+            for f in sorted(pathlib.Path(__file__).parent.glob('*.py')):
+                AnalysisCache.version += f.read_bytes()
+        if not os.path.exists(cache_dir):
+            os.makedirs(cache_dir, exist_ok=True)
+
+    def get_key(self, input_file):
+        with open(input_file, 'rb') as reader:
+            return self.get_source_key(reader.read())
+
+    def get_source_key(self, source):
+        # source is the code of the program (in bytes) as written by make_output_dir
+        return hashlib.sha1(self.namespace.encode() + b'\0' + self.version + source).hexdigest()
+
+    def get_entry_name(self, key):
+        return self.cache_dir + '/' + key + '.pkl.gz'
+
+    def get(self, key):
+        # returns None if the program is not in the cache, or if its entry can not be read or was not written by the same tool
+        p_name = self.get_entry_name(key)
+        try:
+            with gzip.open(p_name, 'rb') as fp:
+                entry = pickle.load(fp)
+            # the modification time of the entries tells which were used last
+            os.utime(p_name)
+        except (OSError, EOFError, zlib.error, pickle.UnpicklingError, AttributeError, ImportError):
+            # e.g. entries written by a script run as __main__, whose classes can not be found by the other scripts
+            return None
+        if not isinstance(entry, tuple) or len(entry) != 2 or entry[0] != self.namespace:
+            return None
+        return entry[1]
+
+    def put(self, key, entry):
+        p_name = self.get_entry_name(key)
+        # the entry is written to a temporary file first, so the other workers never read half written entries
+        tmp_name = p_name + '.{pid}.tmp'.format(pid=os.getpid())
+        try:
+            with gzip.open(tmp_name, 'wb') as fp:
+                pickle.dump((self.namespace, entry), fp, protocol=pickle.HIGHEST_PROTOCOL)
+            entry_size = os.path.getsize(tmp_name)
+            os.replace(tmp_name, p_name)
+        except (OSError, RecursionError, pickle.PicklingError):
+            # e.g. ASTs too deep to be pickled
+            if os.path.exists(tmp_name):
+                os.remove(tmp_name)
+            return
+        self.written += entry_size
+        if self.size is not None:
+            self.size += entry_size
+        if self.size is None or self.size > self.max_size or self.written > self.max_size * (1 - self.low_water):
+            self.evict()
+
+    def evict(self):
+        entries = []
+        for f in os.scandir(self.cache_dir):
+            if f.name.endswith('.pkl.gz'):
+                try:
+                    st = f.stat()
+                except OSError:
+                    continue
+                entries.append((st.st_mtime, st.st_size, f.path))
+        total_size = sum(e[1] for e in entries)
+        if total_size > self.max_size:
+            for mtime, size, p_name in sorted(entries):
+                if total_size <= self.max_size * self.low_water:
+                    break
+                try:
+                    os.remove(p_name)
+                except OSError:
+                    pass
+                total_size -= size
+        self.size = total_size
+        self.written = 0
+
+# the caches opened by this process, so each one is only scanned once
+analysis_caches = dict()
+
+def get_analysis_cache(cache_dir, max_size, namespace):
+    if (cache_dir, max_size, namespace) not in analysis_caches:
+        analysis_caches[(cache_dir, max_size, namespace)] = AnalysisCache(cache_dir, max_size, namespace)
+    return analysis_caches[(cache_dir, max_size, namespace)]
+
+#-----------------------------------------------------------------
+# In-process validation of the generated programs, instead of preprocessing and parsing the output files again.
+# The macros of the programs are already expanded, so the only thing the parser needs from the headers are the names of their typedefs.
+
+def get_typedef_names(ast):
+    # the names of the typedefs declared in the headers i.e., before the fakestart function
+    typedef_names = set()
+    for x in ast.ext:
+        if isinstance(x, c_ast.FuncDef) and "fakestart" in x.decl.type.type.declname:
+            return typedef_names
+        if isinstance(x, c_ast.Typedef):
+            typedef_names.add(x.name)
+    # for the case of our injected function which do not have the fakestart function in their ast
+    return set()
+
+def is_valid_program(str_ast, typedef_names, validated_programs):
+    # the typedefs used by the program are declared before its code, their actual types do not matter to the parser.
+    # validated_programs holds the result of each validation of the programs generated from the same program, indexed by the hash of the code validated
+    used_typedefs = typedef_names & set(identifier_re.findall(str_ast))
+    code = "".join("typedef int {t};\n".format(t=t) for t in sorted(used_typedefs)) + str_ast
+    key = hashlib.sha1(code.encode()).hexdigest()
+    if key not in validated_programs:
+        try:
+            get_parser().parse(code)
+            validated_programs[key] = True
+        except:
+            validated_programs[key] = False
+    return validated_programs[key]
+
+#-----------------------------------------------------------------
+# A code generator for the programs generated from the same AST, that reuses the code of the subtrees that are the same in every program.
+# The code of a node only depends on its subtree and on the current indentation, so the code of each node of the original AST is kept
+# (for each indentation) and reused while the node is not changed. The nodes that are not in the original AST (e.g. the nodes built by
+# the mutations) are always generated.
+class MemoCGenerator(c_generator.CGenerator):
+
+    def __init__ (self):
+        super().__init__()
+        self.memo = dict()
+        self.origins = None
+        self.changed = set()
+
+    def generate(self, ast, origins, changed=set()):
+        # origins is given by copy_ast when ast is built from a copy of the original AST (or by get_ast_origins if ast is the original AST),
+        # and changed has the ids of the nodes of ast whose code is not the same as in the original AST
+        self.origins = origins
+        self.changed = changed
+        self.indent_level = 0
+        return self.visit(ast)
+
+    def visit(self, node):
+        original = self.origins.get(id(node), (None, None))[1]
+        # the function definitions also reset the indentation
+        if original is None or id(node) in self.changed or isinstance(node, (c_ast.FuncDef, c_ast.FileAST)):
+            return c_generator.CGenerator.visit(self, node)
+        key = (id(original), self.indent_level)
+        if key not in self.memo:
+            self.memo[key] = c_generator.CGenerator.visit(self, node)
+        return self.memo[key]
+
+    def visit_FileAST(self, n):
+        s = []
+        for ext in n.ext:
+            if isinstance(ext, c_ast.FuncDef):
+                s.append(self.visit(ext))
+            elif isinstance(ext, c_ast.Pragma):
+                s.append(self.visit(ext) + '\n')
+            else:
+                s.append(self.visit(ext) + ';\n')
+        return ''.join(s)
+
+def get_ast_origins(ast):
+    # the origins (see copy_ast) of an AST that is changed in place, each node of the AST is its own original
+    origins = dict()
+    stack = [ast]
+    while stack != []:
+        node = stack.pop()
+        origins[id(node)] = (node, node)
+        stack.extend(child for _, child in node.children())
+    return origins
+
+def get_parent_nodes(ast):
+    # maps the id of each node of the AST to its parent node
+    parents = dict()
+    stack = [ast]
+    while stack != []:
+        node = stack.pop()
+        for name, child in node.children():
+            parents[id(child)] = node
+            stack.append(child)
+    return parents
+
 #-----------------------------------------------------------------
 # A visitor that removes the fakestart
 class CleanUpVisitor(c_ast.NodeVisitor):
@@ -0,0 +1,146 @@
+#!/usr/bin/python
+#Title			: mutation_space.py
+#Usage			: python mutation_space.py
+#Author			: pmorvalho
+#Date			: June 20, 2022
+#Description     	: Lazy representations of the sets of mutations that can be applied to a program.
+#Notes			:
+#Python Version: 3.8.5
+# (C) Copyright 2022 Pedro Orvalho.
+#==============================================================================
+
+import sys
+import random
+from collections.abc import Sequence
+from numpy import binary_repr
+
+#-----------------------------------------------------------------
+
+def range_size(r):
+    # len(range) raises an OverflowError for ranges with more than sys.maxsize elements
+    if r.step > 0:
+        return max(0, (r.stop - r.start + r.step - 1) // r.step)
+    return max(0, (r.start - r.stop - r.step - 1) // -r.step)
+
+def axis_size(axis):
+    if isinstance(axis, range):
+        return range_size(axis)
+    if hasattr(axis, "size"):
+        return axis.size
+    return len(axis)
+
+#-----------------------------------------------------------------
+# The list of all the binary numbers with num_ops bits, where each bit says if the mutation is applied to each location of the program or not.
+# The binary numbers are never stored, the i-th element is decoded on demand e.g. 2 -> ["10", [True, False]]
+class BinaryLists(Sequence):
+
+    def __init__ (self, num_ops, indices=None):
+        self.num_ops = num_ops
+        # the binary numbers in this (sub)list
+        self.indices = range(2**num_ops) if indices is None else indices
+
+    @property
+    def size(self):
+        return range_size(self.indices)
+
+    def __len__(self):
+        return self.size
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return BinaryLists(self.num_ops, self.indices[i])
+        return self.decode(self.indices[i])
+
+    def __iter__(self):
+        for n in self.indices:
+            yield self.decode(n)
+
+    def decode(self, n):
+        bn = binary_repr(n, width=self.num_ops)
+        return [bn, [b == "1" for b in bn]]
+
+
+#-----------------------------------------------------------------
+# The cartesian product of several mutation axes (e.g. the comparison operators to mirror, the reorderings of the declarations, ...).
+# Each program is identified by an index in mixed radix, where the last axis changes the fastest, i.e. the same order as a set of
+# nested for-loops over the axes. Index 0 is the program built from the first element of every axis.
+def split_quotas(quotas, num_progs):
+    # The quotas reduced so that their sum is at most num_progs. The sample is split evenly between the axes,
+    # and what the smaller quotas do not need is split between the larger ones.
+    if sum(quotas) <= num_progs:
+        return quotas
+    n_quotas = list(quotas)
+    axes = sorted((a for a in range(len(quotas)) if quotas[a] > 0), key=lambda a: quotas[a])
+    for k in range(len(axes)):
+        a = axes[k]
+        n_quotas[a] = min(quotas[a], num_progs // (len(axes) - k))
+        num_progs -= n_quotas[a]
+    return n_quotas
+
+class MutationSpace:
+
+    def __init__ (self, axes):
+        self.axes = axes
+        self.radices = [axis_size(a) for a in axes]
+        self.size = 1
+        for r in self.radices:
+            self.size *= r
+
+    def decode(self, i):
+        # returns the position of program i in each axis
+        digits = [0]*len(self.radices)
+        for a in range(len(self.radices)-1, -1, -1):
+            i, digits[a] = divmod(i, self.radices[a])
+        return digits
+
+    def encode(self, digits):
+        i = 0
+        for a in range(len(self.radices)):
+            i = i*self.radices[a] + digits[a]
+        return i
+
+    def __getitem__(self, i):
+        return [self.axes[a][d] for a, d in enumerate(self.decode(i))]
+
+    def sample(self, num_progs, quotas=None, rng=random):
+        # Draws num_progs distinct programs uniformly at random (with the random generator rng), without enumerating the space.
+        # Program 0 is always part of the sample, since the variable mappings refer to it.
+        # quotas is an optional list with, for each axis, the minimum number of sampled programs whose position in that axis is not 0.
+        # The quotas are reduced (see split_quotas) when they do not fit in the sample, so the sample never has more than num_progs programs.
+        # Returns the sorted list of the indices of the programs.
+        if num_progs >= self.size:
+            return list(range(self.size))
+        sampled = {0}
+        if quotas is not None:
+            # there are only size/r*(r-1) programs whose position in an axis with r positions is not 0
+            quotas = [min(q, self.size // r * (r-1)) for q, r in zip(quotas, self.radices)]
+            quotas = split_quotas(quotas, num_progs - 1)
+            for a in range(len(self.radices)):
+                r = self.radices[a]
+                if r <= 1:
+                    continue
+                q = quotas[a]
+                q -= sum(1 for i in sampled if self.decode(i)[a] != 0)
+                while q > 0:
+                    digits = [rng.randrange(rd) for rd in self.radices]
+                    digits[a] = rng.randrange(1, r)
+                    i = self.encode(digits)
+                    if i not in sampled:
+                        sampled.add(i)
+                        q -= 1
+        num_progs -= len(sampled)
+        if quotas is None and self.size - 1 <= sys.maxsize:
+            # sample only selects the indices, the range is never materialized
+            sampled.update(rng.sample(range(1, self.size), max(num_progs, 0)))
+        else:
+            while num_progs > 0:
+                i = rng.randrange(1, self.size)
+                if i not in sampled:
+                    sampled.add(i)
+                    num_progs -= 1
+        return sorted(sampled)
+
+
+if __name__ == '__main__':
+    print(list(BinaryLists(2)))
+    print(MutationSpace([BinaryLists(40), range(2), BinaryLists(30)]).sample(5))
@@ -15,10 +15,13 @@ import re
 from copy import deepcopy
 import argparse
 from sys import argv
+import shutil
 from shutil import copyfile
-from topological_sorting import getTopologicalOrders
+from topological_sorting import countTopologicalOrders, TopologicalOrders
+from mutation_space import BinaryLists, MutationSpace, axis_size
 
 from itertools import product
+from functools import partial
 from numpy import binary_repr
 import pickle
 import gzip
@@ -37,6 +40,8 @@ from helper import *
 
 bin_ops_2_swap = {"<" : ">", ">" : "<", "<=" : ">=", ">=" : "<=", "==" : "==", "!=" : "!="}
 incr_decr_ops = {"p++" : "++", "++" : "p++", "--" : "p--", "p--" : "--"}
+# when the number of possible programs is higher than this, only a sample of the programs is generated (unless the user asks for all of them)
+max_sampled_progs = 250
 
 #-----------------------------------------------------------------
 class MutatorVisitor(ASTVisitor):
@@ -45,14 +50,12 @@ class MutatorVisitor(ASTVisitor):
         super().__init__()
         # list with the program variables
         self.scope_vars = dict()
-        # number of binary operations to swap
-        self.num_bin_ops_2_swap = 0
-        # coords of the if nodes to swap
-        self.if_2_swap_ids = list()
+        # integer ids of the nodes, in the order they are visited
+        self.ids = NodeIds()
+        # ids of the nodes where each of the registered mutations can be applied (see Mutation)
+        self.sites = SiteIndex()
         # flag to use while checking an if-statement
         self.check_simple_if_else = False
-        # coord of the increment/decrement nodes to swap
-        self.inc_ops_2_swap_ids = list()
         # flag to check if the increment/decrement operator is being used inside an assignment or a binary op
         self.safe_inc_op = 1
         # dict with infromations about the variables declared inside each scope
@@ -68,15 +71,20 @@ class MutatorVisitor(ASTVisitor):
         self.blocks_vars[self.curr_block]["decls_id"] = []
         self.blocks_vars[self.curr_block]["var_2_coord"] = dict()
         self.blocks_vars[self.curr_block]["decls_dependencies"] = []
-        self.blocks_vars[self.curr_block]["permutations"] = []
+        self.blocks_vars[self.curr_block]["num_permutations"] = 0
         # translating for-loops into while-loops
         self.found_continue = False
-        self.for_ids_2_swap = []
         
     def visit(self, node):
         #node.show()
         return c_ast.NodeVisitor.visit(self, node)
 
+    def collect_sites(self, node, node_id):
+        # asks each mutation applied to this type of nodes if the node is one of its sites
+        for m in site_mutations.get(type(node).__name__, []):
+            if m.is_site(self, node):
+                self.sites.add_site(m.sites, node_id)
+
     def visit_FileAST(self, node):
         #print('****************** Found FileAST Node *******************')
         n_ext = []
@@ -113,8 +121,9 @@ class MutatorVisitor(ASTVisitor):
             type = type.type.names[0]
 
         if self.curr_block is not None:
-            self.blocks_vars[self.curr_block]["decls_id"].append(node_id(node.coord))
-            self.blocks_vars[self.curr_block]["var_2_coord"][node.name] = node_id(node.coord)
+            decl_id = self.ids.new_id("Decl")
+            self.blocks_vars[self.curr_block]["decls_id"].append(decl_id)
+            self.blocks_vars[self.curr_block]["var_2_coord"][node.name] = decl_id
         self.scope_vars[node.name] = type
         self.curr_var = node.name
         if node.init != None:
@@ -130,8 +139,9 @@ class MutatorVisitor(ASTVisitor):
         # node.show()
         if isinstance(node.type, c_ast.TypeDecl):
             if self.curr_block is not None:
-                self.blocks_vars[self.curr_block]["decls_id"].append(node_id(node.coord))
-                self.blocks_vars[self.curr_block]["var_2_coord"][node.type.declname] = node_id(node.coord)
+                decl_id = self.ids.new_id("Decl")
+                self.blocks_vars[self.curr_block]["decls_id"].append(decl_id)
+                self.blocks_vars[self.curr_block]["var_2_coord"][node.type.declname] = decl_id
             self.scope_vars[node.type.declname] = "array-"+node.type.type.names[0]
             self.curr_var = node.type.declname
         
@@ -164,26 +174,27 @@ class MutatorVisitor(ASTVisitor):
 
     def visit_UnaryOp(self, node):
         #print('****************** Found Unary Operation *******************')
-        if self.safe_inc_op == 1 and node.op in incr_decr_ops.keys():
-            self.inc_ops_2_swap_ids.append(node.coord)
+        unary_id = self.ids.new_id("UnaryOp")
+        self.collect_sites(node, unary_id)
         node.expr = self.visit(node.expr)
         return node
     
     def visit_BinaryOp(self, node):
         # print('****************** Found Binary Operation *******************')
         # print(node.show())
+        bin_op_id = self.ids.new_id("BinaryOp")
         self.safe_inc_op -= 1
         left = self.visit(node.left)
         right = self.visit(node.right)
         self.safe_inc_op += 1
-        if node.op in bin_ops_2_swap.keys():
-            self.num_bin_ops_2_swap += 1
+        self.collect_sites(node, bin_op_id)
         return c_ast.BinaryOp(node.op, left, right, node.coord)
 
     def visit_TernaryOp(self, node):
         # print('****************** Found Ternary Op Node *******************')
-        if_id = node_id(node.coord)
-        self.if_2_swap_ids.append(if_id)
+        # if-statements and ternary operators share the same ids
+        if_id = self.ids.new_id("If")
+        self.collect_sites(node, if_id)
         n_cond = self.visit(node.cond)
         n_iftrue = self.visit(node.iftrue)
         n_iffalse = node.iffalse
@@ -230,13 +241,13 @@ class MutatorVisitor(ASTVisitor):
     def visit_Compound(self, node):
         #print('****************** Found Compound Node *******************')
         block_items = node.block_items
-        coord = node_id(node.coord)
+        coord = self.ids.new_id("Compound")
         self.curr_block = str(coord)
         self.blocks_vars[self.curr_block] = dict()
         self.blocks_vars[self.curr_block]["decls_id"] = []
         self.blocks_vars[self.curr_block]["var_2_coord"] = dict()
         self.blocks_vars[self.curr_block]["decls_dependencies"] = []
-        self.blocks_vars[self.curr_block]["permutations"] = []
+        self.blocks_vars[self.curr_block]["num_permutations"] = 0
         n_block_items = []
         if block_items is not None:
             for x in block_items:
@@ -248,12 +259,12 @@ class MutatorVisitor(ASTVisitor):
                 self.declaring_var = False
                 self.curr_block = str(coord)
 
-        self.blocks_vars[self.curr_block]["permutations"] = getTopologicalOrders(self.blocks_vars[self.curr_block]["decls_id"], self.blocks_vars[self.curr_block]["decls_dependencies"])
+        # the reorderings themselves are only unranked when a program needs them (see BlocksReorderings)
+        self.blocks_vars[self.curr_block]["num_permutations"] = countTopologicalOrders(self.blocks_vars[self.curr_block]["decls_id"], self.blocks_vars[self.curr_block]["decls_dependencies"])
         # print(self.blocks_vars[self.curr_block]["var_2_coord"])
         # print("dependencies")
         # print(self.blocks_vars[self.curr_block]["decls_dependencies"])
-        # print(len(self.blocks_vars[self.curr_block]["permutations"]))
-        # print(self.blocks_vars[self.curr_block]["permutations"])
+        # print(self.blocks_vars[self.curr_block]["num_permutations"])
         if self.blocks_vars[self.curr_block]["decls_id"] == []:
             del self.blocks_vars[self.curr_block]
 
@@ -263,7 +274,7 @@ class MutatorVisitor(ASTVisitor):
 
     def visit_If(self, node):
         #print('****************** Found IF Node *******************')
-        if_id = node_id(node.coord)
+        if_id = self.ids.new_id("If")
         n_cond = self.visit(node.cond)
         if isinstance(node.iftrue, c_ast.Compound):
             n_iftrue = self.visit(node.iftrue)
@@ -277,9 +288,7 @@ class MutatorVisitor(ASTVisitor):
         if node.iffalse is not None and not isinstance(node.iffalse, c_ast.Compound):
             node.iffalse = c_ast.Compound([node.iffalse], node.iffalse.coord)
         n_iffalse = self.visit(node.iffalse)
-        # if there exists and else statement
-        if n_iffalse is not None and self.check_simple_if_else:
-            self.if_2_swap_ids.append(if_id)
+        self.collect_sites(node, if_id)
         # if is just an if without and else or if we already saved the id of the node we can turn off the flag. 
         self.check_simple_if_else = False
         #print('****************** New Cond Node *******************')
@@ -288,17 +297,15 @@ class MutatorVisitor(ASTVisitor):
 
     def visit_For(self, node):
         # print('****************** Found For Node *******************')
-        for_id = node_id(node.coord)
+        for_id = self.ids.new_id("For")
         n_init = self.visit(node.init)
         n_cond = self.visit(node.cond)
         self.find_continue = False
         if not isinstance(node.stmt, c_ast.Compound):
             node.stmt = c_ast.Compound([node.stmt], node.stmt.coord)
         n_stmt = self.visit(node.stmt)
-        if self.found_continue:
-            self.found_continue = False
-        else:
-            self.for_ids_2_swap.append(for_id)            
+        self.collect_sites(node, for_id)
+        self.found_continue = False
         n_next = self.visit(node.next)
         # We dont need to put a scope_info at the end of the for because the compound node already does that
         n_for = c_ast.For(n_init, n_cond, n_next, n_stmt, node.coord)
@@ -306,7 +313,6 @@ class MutatorVisitor(ASTVisitor):
 
     def visit_While(self, node):
         #print('****************** Found While Node *******************')
-        while_id = node_id(node.coord)
         n_cond = self.visit(node.cond)
         n_stmt = self.visit(node.stmt)
         n_while = c_ast.While(c_ast.ExprList([n_cond]), n_stmt, node.coord)
@@ -322,172 +328,137 @@ class MutatorVisitor(ASTVisitor):
         return node
     
 #-----------------------------------------------------------------
-# A visitor that swaps the arguments of binary operators such as >, < <=, >=
-class SwapBinOpsVisitor(MutatorVisitor):
+# A visitor that applies all the mutations of a mutated program in a single traversal of the AST.
+# The nodes get the same ids as in the MutatorVisitor that analysed the program, and the sites of each mutation are the ones in its SiteIndex.
+# mutations holds the value of each mutation applied to the program (the ones the user did not ask for are missing).
+# The value of the mutations applied to sites is a list of flags, the i-th flag says if the i-th site of that mutation to be visited is mutated or not.
+class ApplyMutationsVisitor(MutatorVisitor):
 
-    def __init__ (self, bin_ops_2_swap):
+    def __init__ (self, program_sites, mutations, vars_set, origins=None):
         super().__init__()
-        # bin_ops_2_swap is a list of booleans that says if each binary operation is to swap or not
-        self.bin_ops_2_swap = bin_ops_2_swap
+        self.program_sites = program_sites
+        self.mutations = mutations
+        # number of sites of each mutation already visited
+        self.n_sites = {m : 0 for m in self.mutations.keys()}
+        self.blocks_reordering = self.mutations.get("reord_decls", list())
+        self.vars_set = vars_set
+        self.new_var = self.mutations.get("dummy_var", False)
+        # the nodes being visited, and the ids of the nodes whose code is changed by the mutations (see MemoCGenerator)
+        self.path = []
+        self.changed = set()
+        # the origins of the nodes of the copy of the AST being mutated (see copy_ast)
+        self.origins = origins
         
     def visit(self, node):
-        return MutatorVisitor.visit(self, node)
+        self.path.append(node)
+        n_node = MutatorVisitor.visit(self, node)
+        self.path.pop()
+        if n_node is not node and self.origins is not None and id(node) not in self.changed:
+            self.keep_origin(node, n_node)
+        return n_node
+
+    def keep_origin(self, node, n_node):
+        # a node rebuilt without any mutation has the same code as its original node if its children are the ones of the original node
+        # (e.g. the bodies of the if-statements put in blocks are not)
+        original = self.origins.get(id(node), (None, None))[1]
+        if original is None or type(n_node) is not type(original):
+            return
+        for attr in original.__slots__[:-2]:
+            if not self.same_origin(getattr(n_node, attr), getattr(original, attr)):
+                return
+        self.origins[id(n_node)] = (n_node, original)
+
+    def same_origin(self, value, original):
+        if isinstance(original, list):
+            return isinstance(value, list) and len(value) == len(original) and all(self.same_origin(v, o) for v, o in zip(value, original))
+        if isinstance(original, c_ast.Node):
+            return self.origins.get(id(value), (None, None))[1] is original
+        return value == original
+
+    def mark_changed(self):
+        # the nodes being visited contain a mutation
+        self.changed.update(id(n) for n in self.path)
+
+    def mutate_site(self, mutation, node_id):
+        # checks if the node is a site of the mutation, and if so consumes the flag of the next site
+        if mutation.name not in self.mutations or not self.program_sites.is_site(mutation.sites, node_id):
+            return False
+        flags = self.mutations[mutation.name]
+        i = self.n_sites[mutation.name]
+        self.n_sites[mutation.name] += 1
+        if i < len(flags) and flags[i]:
+            self.mark_changed()
+            return True
+        return False
+
+    def apply_site_mutations(self, node, node_id):
+        # node is already built from its visited children, each mutation whose flag is set replaces it by its mutated node
+        for m in site_mutations.get(type(node).__name__, []):
+            if not m.in_block and self.mutate_site(m, node_id):
+                node = m.apply(self, node)
+        return node
+
+    def apply_block_mutations(self, node):
+        # mutations that replace a statement of a block by a list of statements, before the statement is visited.
+        # Returns None if the statement is not mutated.
+        for m in site_mutations.get(type(node).__name__, []):
+            node_id = self.ids.next_id(type(node).__name__)
+            if m.in_block and self.mutate_site(m, node_id):
+                self.ids.new_id(type(node).__name__)
+                return m.apply(self, node)
+        return None
 
     def visit_BinaryOp(self, node):
-        # print('****************** Found Binary Operation *******************')
-        # print(node.show())
+        bin_op_id = self.ids.new_id("BinaryOp")
         left = self.visit(node.left)
         right = self.visit(node.right)
-        if node.op in bin_ops_2_swap.keys() and len(self.bin_ops_2_swap) > 0:
-            if self.bin_ops_2_swap[0]:
-                self.bin_ops_2_swap.pop(0)
-                return c_ast.BinaryOp(bin_ops_2_swap[node.op], right, left, node.coord)
-            else:
-                self.bin_ops_2_swap.pop(0)
-                
-        return c_ast.BinaryOp(node.op, left, right, node.coord)
-
-#-----------------------------------------------------------------
-# A visitor that swaps the simple if-statements by negating its test condition and swapping the if-block with the else-block.
-class SwapIfElseVisitor(MutatorVisitor):
-
-    def __init__ (self, ifs_2_swap, if_ids):
-        super().__init__()
-        self.ifs_2_swap = ifs_2_swap
-        self.ifs_ids = if_ids
-        
-    def visit(self, node):
-        return MutatorVisitor.visit(self, node)
+        return self.apply_site_mutations(c_ast.BinaryOp(node.op, left, right, node.coord), bin_op_id)
 
     def visit_If(self, node):
-        #print('****************** Found IF Node *******************')
-        if_id = node_id(node.coord)
+        if_id = self.ids.new_id("If")
         n_cond = self.visit(node.cond)
+        if not isinstance(node.iftrue, c_ast.Compound):
+            node.iftrue = c_ast.Compound([node.iftrue], node.iftrue.coord)
         n_iftrue = self.visit(node.iftrue)
+        if node.iffalse is not None and not isinstance(node.iffalse, c_ast.Compound):
+            node.iffalse = c_ast.Compound([node.iffalse], node.iffalse.coord)
         n_iffalse = self.visit(node.iffalse)
-        # if there exists and else statement
-        if if_id in self.ifs_ids and len(self.ifs_2_swap) > 0:
-            if self.ifs_2_swap[0]:
-                self.ifs_2_swap.pop(0)
-                return c_ast.If(c_ast.UnaryOp("!", n_cond, node.coord) , n_iffalse, n_iftrue, node.coord)
-            self.ifs_2_swap.pop(0)
-        n_if = c_ast.If(n_cond, n_iftrue, n_iffalse, node.coord)
-        return n_if
+        return self.apply_site_mutations(c_ast.If(n_cond, n_iftrue, n_iffalse, node.coord), if_id)
 
     def visit_TernaryOp(self, node):
-        # print('****************** Found Ternary Op Node *******************')
-        if_id = node_id(node.coord)
+        if_id = self.ids.new_id("If")
         n_cond = self.visit(node.cond)
         n_iftrue = self.visit(node.iftrue)
-        n_iffalse = self.visit(node.iffalse)        
-        if if_id in self.ifs_ids and len(self.ifs_2_swap) > 0:
-            if self.ifs_2_swap[0]:
-                self.ifs_2_swap.pop(0)
-                return c_ast.TernaryOp(c_ast.UnaryOp("!", n_cond, node.coord), n_iffalse, n_iftrue, node.coord)
-            self.ifs_2_swap.pop(0)
-        return c_ast.TernaryOp(n_cond, n_iftrue, n_iffalse, node.coord)
-
-#-----------------------------------------------------------------
-# A visitor that swaps the increment/decrement operators (++, --) when these are not being used inside an assignment or a binary operation.
-class SwapIncrDecrOpsVisitor(MutatorVisitor):
-    def __init__ (self, inc_ops_2_swap, inc_ops_ids):
-        super().__init__()
-        self.inc_ops_2_swap = inc_ops_2_swap
-        self.inc_ops_ids = inc_ops_ids
-        
-    def visit(self, node):
-        return MutatorVisitor.visit(self, node)
+        n_iffalse = self.visit(node.iffalse)
+        return self.apply_site_mutations(c_ast.TernaryOp(n_cond, n_iftrue, n_iffalse, node.coord), if_id)
 
     def visit_UnaryOp(self, node):
-        # print('****************** Found Binary Operation *******************')
-        # print(node.show())
+        unary_id = self.ids.new_id("UnaryOp")
         expr = self.visit(node.expr)
-        if node.op in incr_decr_ops.keys() and len(self.inc_ops_2_swap) > 0:
-            if self.inc_ops_2_swap[0]:
-                self.inc_ops_2_swap.pop(0)
-                return c_ast.UnaryOp(incr_decr_ops[node.op], expr, node.coord)
-            else:
-                self.inc_ops_2_swap.pop(0)
-                
-        return c_ast.UnaryOp(node.op, expr, node.coord)
-
-
-#-----------------------------------------------------------------
-# A visitor that declares a new dummy variable in the main's block. A variable that is not used througout the program.
-class DeclDumVarVisitor(MutatorVisitor):
-    def __init__ (self, vars_set, new_var=True):
-        super().__init__()
-        self.new_var = new_var
-        self.vars_set = vars_set
-        
-    def visit(self, node):
-        return MutatorVisitor.visit(self, node)
-
-    def visit_FuncDef(self, node):
-        #print('****************** Found FuncDef Node *******************')
-        body = node.body
-        coord = node.coord
-        if "main" == node.decl.name and self.new_var:
-            last_decl = -1
-            # each functions definition has a compound node inside a compound node for some reason.
-            # that why we are using body.block_items[0].block_items
-            for i in range(len(body.block_items)):
-                x = body.block_items[i]
-                if isinstance(x, c_ast.Compound):
-                    for j in range(len(x.block_items)):
-                        z = x.block_items[j]
-                        if isinstance(z, c_ast.Decl) and isinstance(z.type, c_ast.TypeDecl):
-                            last_decl = j
-                            continue
-                        else:
-                            break
-                    new_var_name = gen_fresh_var_name(self.vars_set, "int")
-                    body.block_items[i].block_items.insert(last_decl+1, c_ast.Decl(name=new_var_name,
-                        quals=[],
-                        storage=[],
-                        funcspec=[],
-                        align=[],
-                        type=c_ast.TypeDecl(new_var_name, quals=[], align=[], type=c_ast.IdentifierType(['int']), coord=node.coord),
-                        init=None,
-                        bitsize=None,
-                        coord=node.coord))
-                else:
-                    if isinstance(x, c_ast.Decl) and isinstance(x.type, c_ast.TypeDecl):
-                        last_decl = i
-                        continue
-                    else:
-                        new_var_name = gen_fresh_var_name(self.vars_set, "int")
-                        body.block_items.insert(last_decl+1, c_ast.Decl(name=new_var_name,
-                        quals=[],
-                        storage=[],
-                        funcspec=[],
-                        align=[],
-                        type=c_ast.TypeDecl(new_var_name, quals=[], align=[], type=c_ast.IdentifierType(['int']), coord=node.coord),
-                        init=None,
-                        bitsize=None,
-                        coord=node.coord))
-                        break
-        n_body = self.visit(body)
-        n_func_def_ast = c_ast.FuncDef(node.decl, node.param_decls, n_body, coord)
-        return n_func_def_ast
-
-#-----------------------------------------------------------------
-# A visitor that reorder the variable declarations in a program based on the provided topological sorting.
-class ReorderVarDeclsVisitor(MutatorVisitor):
-    def __init__ (self, blocks_reordering):
-        super().__init__()
-        self.blocks_reordering = blocks_reordering
-        
-    def visit(self, node):
-        return MutatorVisitor.visit(self, node)
+        return self.apply_site_mutations(c_ast.UnaryOp(node.op, expr, node.coord), unary_id)
 
-    def visit_Compound (self, node):
-        #print('****************** Found Compound Node *******************')
+    def visit_Compound(self, node):
+        # applies the mutations of the statements of the block (e.g. for-loops into while-loops), and
+        # reorders the variable declarations of the block based on the provided topological sorting
+        coord = self.ids.new_id("Compound")
         block_items = node.block_items
-        coord = node_id(node.coord)
         n_block_items = []
         if block_items is not None:
-            if str(coord) in self.blocks_reordering.keys():
+            # the items are visited in their original order, so the ids of the nodes do not depend on the reordering
+            n_items = []
+            n_decls = dict()
+            for x in block_items:
+                n_x = self.apply_block_mutations(x)
+                if n_x is not None:
+                    n_items.append(n_x)
+                else:
+                    decl_id = self.ids.next_id("Decl")
+                    n_items.append([self.visit(x)])
+                    if isinstance(x, c_ast.Decl) and self.ids.next_id("Decl") > decl_id:
+                        n_decls[decl_id] = n_items[-1][0]
+
+            if str(coord) in self.blocks_reordering:
+                self.mark_changed()
                 last_decl = 0
                 for i in range(len(block_items)):
                     x = block_items[i]
@@ -498,103 +469,137 @@ class ReorderVarDeclsVisitor(MutatorVisitor):
                         break
                 new_order = []
                 for d in self.blocks_reordering[str(coord)]:
-                    for x in block_items:
-                        if str(node_id(x.coord)) == str(d):
-                            new_order.append(x)
-                            break
-                # block_items = new_order + block_items[last_decl:] if args.dummy_var or args.all_mut else new_order + block_items[last_decl+1:]
-                block_items = new_order + block_items[last_decl+1:]
-                
-            for x in block_items:
-                n_block_items.append(self.visit(x))
+                    if d in n_decls.keys():
+                        new_order.append([n_decls[d]])
+                n_items = new_order + n_items[last_decl+1:]
+
+            for n_x in n_items:
+                n_block_items += n_x
                 
         n_compound_ast = c_ast.Compound(n_block_items, node.coord)
         return n_compound_ast
 
-def get_possible_blocks_permutations(blocks_info):
-    blocks = []
-    num_decls_per_block = []
-    blocks_permutations = []
-    for b in blocks_info.keys():
-        perms = blocks_info[b]["permutations"]
-        if len(perms) == 0:
-            continue
-        blocks.append(b)
-        blocks_permutations.append(perms)
-        num_decls_per_block.append(list(range(len(perms))))
+    def visit_FuncDef(self, node):
+        # declares a new dummy variable in the main's block. A variable that is not used througout the program.
+        n_func_def_ast = MutatorVisitor.visit_FuncDef(self, node)
+        if "main" == node.decl.name and self.new_var:
+            self.mark_changed()
+            # the block is changed after it was visited
+            self.changed.add(id(n_func_def_ast.body))
+            new_var_name = declare_dummy_var(n_func_def_ast.body, self.vars_set, node.coord)
+            if new_var_name is not None:
+                self.scope_vars[new_var_name] = "int"
+        return n_func_def_ast
 
-    permutations = list(product(*num_decls_per_block))
-    blocks_reorderings = []
-    for p in permutations:
+# The list of all the possible reorderings of the variables' declarations of the program i.e. the product of the topological orders of each block.
+# Each reordering is a dict with the new order of the declarations of each block, together with its index in binary (like the BinaryLists).
+# The reorderings are unranked on demand, so sampling a reordering never enumerates the orderings of the blocks.
+class BlocksReorderings:
+
+    def __init__ (self, blocks_info):
+        self.blocks = []
+        blocks_permutations = []
+        for b in blocks_info.keys():
+            if blocks_info[b]["num_permutations"] == 0:
+                continue
+            self.blocks.append(b)
+            blocks_permutations.append(TopologicalOrders(blocks_info[b]["decls_id"], blocks_info[b]["decls_dependencies"]))
+        self.reorderings = MutationSpace(blocks_permutations)
+        self.size = self.reorderings.size
+
+    def __len__(self):
+        return self.size
+
+    def __getitem__(self, i):
+        bn = binary_repr(i, width=len(binary_repr(self.size)))
+        if self.blocks == []:
+            return [bn, list()]
         d = dict()
-        for b in range(len(p)):
-            # b is the position of the block we are dealing with  
-            i = p[b] # i is the permuation i of block n 
-            d[str(blocks[b])] = blocks_permutations[b][i]
-        blocks_reorderings.append(d)
-
-    if blocks_reorderings == []:
-        return [list()]
-
-    return blocks_reorderings
+        perms = self.reorderings[i]
+        for b in range(len(self.blocks)):
+            # b is the position of the block we are dealing with
+            d[str(self.blocks[b])] = perms[b]
+        return [bn, d]
 
 #-----------------------------------------------------------------
-# A visitor that translates simple for-loops (without any continue instruction) into a while-loop
-class For2WhileVisitor(MutatorVisitor):
-    def __init__ (self, fors_2_swap, fors_ids_2_swap):
-        super().__init__()
-        self.fors_2_swap = fors_2_swap
-        self.fors_ids_2_swap = fors_ids_2_swap
-        
-    def visit(self, node):
-        return MutatorVisitor.visit(self, node)
-
-    def visit_Compound(self, node):
-        #print('****************** Found Compound Node *******************')
-        block_items = node.block_items
-        coord = node.coord
-        n_block_items = []
-        if block_items is not None:
-            for i in range(len(block_items)):
-                x = block_items[i]
-                if isinstance(x, c_ast.For) and (node_id(x.coord) in self.fors_ids_2_swap) and len(self.fors_2_swap) > 0:
-                    if self.fors_2_swap[0]:
-                        self.fors_2_swap.pop(0)
-                        n_block_items.append(self.visit(x.init))
-                        if isinstance(x.stmt, c_ast.Compound):
-                            x.stmt.block_items.append(x.next)
-                            n_block_items.append(self.visit(c_ast.While(x.cond, x.stmt, coord=x.coord)))                   
-                        else:
-                            n_block_items.append(self.visit(c_ast.While(x.cond, c_ast.Compound([x.stmt, x.next], coord=x.coord), coord=x.coord)))                        
-                    else:
-                        self.fors_2_swap.pop(0)
-                        n_block_items.append(self.visit(x))
-                else:
-                    n_block_items.append(self.visit(x))
-                
-        n_compound_ast = c_ast.Compound(n_block_items, coord)
-        return n_compound_ast
+# The mutations the mutator knows about. Each mutation is an axis of the MutationSpace of a program, whose elements are pairs with
+# the name of the element (used in the name of the mutated program) and the value given to the ApplyMutationsVisitor.
+# The mutations applied to sites declare the types of the nodes they mutate, is_site(visitor, node) which tells the MutatorVisitor if a node
+# is one of their sites, and apply(visitor, node) which returns the mutated node (or, for the mutations applied in_block, the list of
+# statements that replace the node in its block). The other mutations declare get_axis(visitor), the list of their elements for a program.
+class Mutation:
+
+    def __init__ (self, name, flag, help, sites=None, node_types=(), is_site=None, apply=None, in_block=False, get_axis=None, quota=True):
+        # name of the option of the mutation and of its entry in the mutation vector of the programs
+        self.name = name
+        self.flag = flag
+        self.help = help
+        # name of the sites of the mutation in the SiteIndex
+        self.sites = sites
+        self.node_types = node_types
+        self.is_site = is_site
+        self.apply = apply
+        self.in_block = in_block
+        self.axis = get_axis
+        # whether the quota of sampled programs (-q) applies to this mutation
+        self.quota = quota
+
+    def get_axis(self, v):
+        if self.axis is not None:
+            return self.axis(v)
+        return BinaryLists(v.sites.num_sites(self.sites))
+
+# the registered mutations, in the order of the mutation vector, and the mutations applied to each type of nodes
+mutations = []
+site_mutations = dict()
+
+def register_mutation(mutation):
+    mutations.append(mutation)
+    for t in mutation.node_types:
+        site_mutations.setdefault(t.__name__, []).append(mutation)
+
+def swap_bin_op(v, node):
+    # swaps the arguments of binary operators such as >, < <=, >=
+    return c_ast.BinaryOp(bin_ops_2_swap[node.op], node.right, node.left, node.coord)
+
+def is_simple_if(v, node):
+    # ternary operators are always swapped, if-statements only when they have an else-block (see MutatorVisitor.visit_If)
+    return isinstance(node, c_ast.TernaryOp) or (node.iffalse is not None and v.check_simple_if_else)
+
+def swap_if_else(v, node):
+    # swaps the simple if-statements by negating its test condition and swapping the if-block with the else-block.
+    return node.__class__(c_ast.UnaryOp("!", node.cond, node.coord), node.iffalse, node.iftrue, node.coord)
+
+def swap_incr_op(v, node):
+    # swaps the increment/decrement operators (++, --) when these are not being used inside an assignment or a binary operation.
+    return c_ast.UnaryOp(incr_decr_ops[node.op], node.expr, node.coord)
+
+def for_2_while(v, node):
+    # translates a simple for-loop (without any continue instruction) into its init statement followed by a while-loop
+    n_init = v.visit(node.init)
+    if not isinstance(node.stmt, c_ast.Compound):
+        node.stmt = c_ast.Compound([node.stmt], node.stmt.coord)
+    if node.stmt.block_items is None:
+        node.stmt.block_items = []
+    node.stmt.block_items.append(node.next)
+    return [n_init, v.visit(c_ast.While(node.cond, node.stmt, coord=node.coord))]
+
+register_mutation(Mutation("comp_ops", "-c", "Swaps the comparison operators.",
+                           sites="bin_ops", node_types=(c_ast.BinaryOp,), is_site=lambda v, node: node.op in bin_ops_2_swap.keys(), apply=swap_bin_op))
+register_mutation(Mutation("if_else", "-if", "Swaps the simple if-else-statements.",
+                           sites="ifs", node_types=(c_ast.If, c_ast.TernaryOp), is_site=is_simple_if, apply=swap_if_else))
+register_mutation(Mutation("incr_ops", "-io", "Swaps the increment operators (e.g. i++, ++i and i+=1) if these are not used in a binary operation or in an assignment.",
+                           sites="inc_ops", node_types=(c_ast.UnaryOp,), is_site=lambda v, node: v.safe_inc_op == 1 and node.op in incr_decr_ops.keys(), apply=swap_incr_op))
+# the dummy variable is declared in the first program of its axis, so every sample already contains programs with and without it
+register_mutation(Mutation("dummy_var", "-dv", "Declares a dummy variable in the beginning of the main function.",
+                           get_axis=lambda v: [["1", True], ["0", False]], quota=False))
+register_mutation(Mutation("reord_decls", "-rd", "Reorder the order of variable declarations, when it is possible i.e., when two variables' declarations do not depend on each other",
+                           get_axis=lambda v: BlocksReorderings(v.blocks_vars)))
+register_mutation(Mutation("for_2_while", "-fw", "Translates simple for-loops (without any continue instruction) into a while-loop.",
+                           sites="fors", node_types=(c_ast.For,), is_site=lambda v, node: not v.found_continue, apply=for_2_while, in_block=True))
 
 #-----------------------------------------------------------------
 
-def gen_binary_lists(num_ops):
-    # Given a natural number num_ops, returns a lists of list of booleans.
-    # each sublist corresponds to a binary number from 0 to num_ops
-    # the binary number is represented as boolean values e.g. 10 -> ["10", ["True", "False"]]
-    bin_lists = []
-    # w = len(binary_repr(num_ops))
-    w = num_ops
-    for n in range(2**(num_ops)):
-        bl = []
-        bn = binary_repr(n, width=w)
-        for b in bn:
-            if b == "0":
-                bl.append(False)
-            elif b == "1":
-                bl.append(True)
-        bin_lists.append([bn,bl])
-    return bin_lists
-
 def gen_fresh_var_name(var_maps, t):
     for i in range(len(var_maps.keys())):
         n_v = "_{t}_{i}_".format(t=t, i=i)
@@ -602,7 +607,47 @@ def gen_fresh_var_name(var_maps, t):
             continue
         return n_v
 
-def gen_variable_mappings(var_maps, bn, bin_numbers, output_dir):
+def new_int_decl(name, coord):
+    return c_ast.Decl(name=name,
+                      quals=[],
+                      storage=[],
+                      funcspec=[],
+                      align=[],
+                      type=c_ast.TypeDecl(name, quals=[], align=[], type=c_ast.IdentifierType(['int']), coord=coord),
+                      init=None,
+                      bitsize=None,
+                      coord=coord)
+
+def declare_dummy_var(body, vars_set, coord):
+    # declares a new int variable after the variables declared in the beginning of the main's block.
+    # Returns the name of the new variable (None if there was no place to declare it).
+    new_var_name = None
+    last_decl = -1
+    # each functions definition has a compound node inside a compound node for some reason.
+    # that why we are using body.block_items[0].block_items
+    for i in range(len(body.block_items)):
+        x = body.block_items[i]
+        if isinstance(x, c_ast.Compound):
+            for j in range(len(x.block_items)):
+                z = x.block_items[j]
+                if isinstance(z, c_ast.Decl) and isinstance(z.type, c_ast.TypeDecl):
+                    last_decl = j
+                    continue
+                else:
+                    break
+            new_var_name = gen_fresh_var_name(vars_set, "int")
+            body.block_items[i].block_items.insert(last_decl+1, new_int_decl(new_var_name, coord))
+        else:
+            if isinstance(x, c_ast.Decl) and isinstance(x.type, c_ast.TypeDecl):
+                last_decl = i
+                continue
+            else:
+                new_var_name = gen_fresh_var_name(vars_set, "int")
+                body.block_items.insert(last_decl+1, new_int_decl(new_var_name, coord))
+                break
+    return new_var_name
+
+def get_variable_mapping(var_maps, bn, bin_numbers):
     # for bn_a in bin_numbers:
     #     if bn_a == bn:
     #         break
@@ -623,31 +668,34 @@ def gen_variable_mappings(var_maps, bn, bin_numbers, output_dir):
         elif v not in other_d.keys() and v not in var_dict.keys():
             var_dict["UnkVar"] = v
 
-    p_name = output_dir+'/var_map-{bn1}_{bn2}.pkl.gz'.format(bn1=bn_a, bn2=bn)
-    fp=gzip.open(p_name,'wb')
-    pickle.dump(var_dict,fp)
-    fp.close()
+    p_name = 'var_map-{bn1}_{bn2}.pkl.gz'.format(bn1=bn_a, bn2=bn)
+    return p_name, var_dict
+
+def is_selected(mutation, config):
+    return getattr(config, mutation.name) or config.all_mut
 
-def get_prog_name(bops, bifs, biops, dv, block, fors):
+def get_mutation_vector(elements, config):
+    # the names of the elements of the mutations required by the user, and the values given to the ApplyMutationsVisitor
+    vector, values = dict(), dict()
+    for m, e in zip(mutations, elements):
+        if is_selected(m, config):
+            vector[m.name], values[m.name] = e
+    return vector, values
+
+def get_prog_name(mutation_vector):
     # based on the users' arguments the name of the program will contain information about the mutations required
-    p_name = ""
-    p_name = bops+"-" if args.comp_ops or args.all_mut else p_name
-    p_name = p_name+bifs+"-" if args.if_else or args.all_mut else p_name
-    p_name = p_name+biops+"-" if args.incr_ops or args.all_mut else p_name
-    p_name = p_name+str(dv)+"-" if args.dummy_var or args.all_mut else p_name
-    p_name = p_name+block+"-" if args.reord_decls or args.all_mut else p_name
-    p_name = p_name+fors+"-" if args.for_2_while or args.all_mut else p_name                                                     
-    return p_name[:-1]
+    return "-".join(mutation_vector.values())
     
-def instrument_file(input_file, output_dir):
-    output_file, sincludes, includes = make_output_dir(input_file, output_dir)#, logfilename, loglibpath)
+def analyse_program(output_file, sincludes, includes, source=None):
     try:
-        ast = parse_file(output_file, use_cpp=True,
-            cpp_path='gcc',
-            cpp_args=['-E', '-Iutils/fake_libc_include'])
+        ast = parse_program(output_file, sincludes, includes, source)
     except:
-        return 0
+        return None
 
+    # the declarations of the headers before the fakestart function are never part of the mutants
+    ast = CleanUpVisitor().visit(ast)
+    # the program is only preprocessed and parsed once, every mutant is built from a copy of this AST
+    original_ast = copy_ast(ast)
     # print('******************** INPUT FILE: ********************')
     v = c_ast.NodeVisitor()
     v.visit(ast)
@@ -655,184 +703,275 @@ def instrument_file(input_file, output_dir):
     # exit()
     # v = VariablesVisitor()
     v = MutatorVisitor()
-    gen = c_generator.CGenerator ()
     n_ast = v.visit(ast)
     # n_ast.show()
     # return
+    return original_ast, v
+
+def get_mutations_space(v, config):
+    # the mutations not required by the user only have the original program in their axis
+    axes = [m.get_axis(v) if is_selected(m, config) else [None] for m in mutations]
+    # each program is an index of the mixed radix space of all the mutations, in the same order as the nested loops over the mutations
+    return MutationSpace(axes)
+
+def get_num_progs(total_progs, config):
+    # the number of programs to generate, only a sample of the programs is generated when there are too many
+    num_progs = total_progs
+    if (not config.enumerate_all or config.percentage_total_progs is not None) and total_progs > max_sampled_progs:
+        perc = 0.2
+        if config.percentage_total_progs is not None:
+            perc = float(config.percentage_total_progs)
+        elif total_progs > 500:
+            perc = 0.1 if total_progs < 100000 else 0.01
+        num_progs = min(max(int(perc*total_progs), 1), max_sampled_progs)
+    return num_progs
+
+def get_progs_2_gen(mutations_space, num_progs, config, rng):
+    if num_progs < mutations_space.size:
+        quotas = None
+        if config.quota is not None:
+            quotas = [config.quota if m.quota else 0 for m in mutations]
+        return mutations_space.sample(num_progs, quotas, rng)
+    return range(mutations_space.size)
+
+def gen_mutated_programs(original_ast, v, mutations_space, progs_2_gen, config):
+    # Generator of the mutated programs, as tuples with the name of the program, its mutation vector, its code (without the includes)
+    # and its mappings (the name and the content of each one).
+    gen = MemoCGenerator()
+    var_maps = dict()
+    prev_nums = list()
+    for p in progs_2_gen:
+        mutation_vector, values = get_mutation_vector(mutations_space[p], config)
+        prev_nums.append(get_prog_name(mutation_vector))
+        curr_num = prev_nums[-1]
+        # every mutation is applied in a single traversal of a copy of the original AST
+        origins = dict()
+        v_h = ApplyMutationsVisitor(v.sites, values, v.scope_vars, origins)
+        b_ast = v_h.visit(copy_ast(original_ast, origins))
+        var_maps[curr_num] = v_h.scope_vars
+        str_ast = gen.generate(b_ast, origins, v_h.changed)
+        yield curr_num, mutation_vector, str_ast, {"var_map" : get_variable_mapping(var_maps, curr_num, prev_nums)}
+
+def instrument_file(input_file, output_dir, rng):
+    # returns the number of programs (with -info) and the number of duplicated programs skipped (with -dd), None otherwise
+    output_file, sincludes, includes = make_output_dir(input_file, output_dir)#, logfilename, loglibpath)
+    # the AST and the analysis of the programs already mutated are read from the cache
+    cache = get_analysis_cache(args.cache_dir, args.cache_size*2**20, "mutator") if args.cache_dir else None
+    key = cache.get_key(output_file) if cache else None
+    analysis = cache.get(key) if cache else None
+    if analysis is None:
+        analysis = analyse_program(output_file, sincludes, includes)
+        if analysis is None:
+            return 0, None
+        if cache:
+            cache.put(key, analysis)
+    original_ast, v = analysis
     if args.verbose:
         print()
         print(input_file)
         print("Variables :", v.scope_vars)
-        print("Number of BinOps of interest:", v.num_bin_ops_2_swap)
-        print("Number of simple if-statements to swap", len(v.if_2_swap_ids))
-        print("Number of increment operators to swap", len(v.inc_ops_2_swap_ids))
-        print("Number of for-loops that can be translated into while-loops:", len(v.for_ids_2_swap))
+        print("Number of BinOps of interest:", v.sites.num_sites("bin_ops"))
+        print("Number of simple if-statements to swap", v.sites.num_sites("ifs"))
+        print("Number of increment operators to swap", v.sites.num_sites("inc_ops"))
+        print("Number of for-loops that can be translated into while-loops:", v.sites.num_sites("fors"))
         print("Declaration of variables:")
         print("  Number of blocks with vars declared:", len(v.blocks_vars))
         ord = 0
         for k in v.blocks_vars.keys():
-            ord += len(v.blocks_vars[k]["permutations"])
+            ord += v.blocks_vars[k]["num_permutations"]
             # print(v.blocks_vars[k])
         print("  Number of permutations:", ord)
     # return
 
-    bin_ops_2_swap = gen_binary_lists(v.num_bin_ops_2_swap) if args.comp_ops or args.all_mut else gen_binary_lists(0)
-    if_elses_2_swap = gen_binary_lists(len(v.if_2_swap_ids)) if args.if_else or args.all_mut else gen_binary_lists(0)
-    inc_ops_2_swap = gen_binary_lists(len(v.inc_ops_2_swap_ids)) if args.incr_ops or args.all_mut else gen_binary_lists(0)
-    dv_limit = -1 if args.dummy_var or args.all_mut else 0
-    fors_2_swap = gen_binary_lists(len(v.for_ids_2_swap)) if args.for_2_while or args.all_mut else gen_binary_lists(0)
-    block_permutations = get_possible_blocks_permutations(v.blocks_vars) if args.reord_decls or args.all_mut else [list()]
-    n_reorderings = len(block_permutations)
-
-    total_progs = len(bin_ops_2_swap)*len(if_elses_2_swap)*len(inc_ops_2_swap)*len(range(1, dv_limit, -1))*n_reorderings*len(fors_2_swap)
+    mutations_space = get_mutations_space(v, args)
+    total_progs = mutations_space.size
     if args.verbose:
-        print("Number of possible reorderings: :", n_reorderings)
+        for m, a in zip(mutations, mutations_space.axes):
+            if is_selected(m, args):
+                print("Number of elements of {m}:".format(m=m.name), axis_size(a))
         print("\n#Total number of programs:", str(total_progs))
-        
-    if not args.enumerate_all or args.percentage_total_progs is not None:
-        perc = 0.2
-        if args.percentage_total_progs is not None:
-            perc = float(args.percentage_total_progs)
-        elif total_progs > 500:
-            perc = 0.1 if total_progs < 100000 else 0.01
 
-        min_per_mutation = 25
-        while total_progs > 250:
-            if len(bin_ops_2_swap) > min_per_mutation:
-                bin_ops_2_swap = [bin_ops_2_swap[0]] + random.sample(bin_ops_2_swap[1:], max(int(perc * len(bin_ops_2_swap)-1), 1))
-            if len(if_elses_2_swap) > min_per_mutation:
-                if_elses_2_swap = [if_elses_2_swap[0]] + random.sample(if_elses_2_swap[1:], max(int(perc * len(if_elses_2_swap)-1), 1))
-            if len(inc_ops_2_swap) > min_per_mutation:
-                inc_ops_2_swap = [inc_ops_2_swap[0]] + random.sample(inc_ops_2_swap[1:], max(int(perc * len(inc_ops_2_swap)-1), 1))
-            if len(fors_2_swap) > min_per_mutation:
-                fors_2_swap = [fors_2_swap[0]] + random.sample(fors_2_swap[1:], max(int(perc * len(fors_2_swap)-1), 1))
-            if len(block_permutations) > min_per_mutation:
-                block_permutations = [block_permutations[0]] + random.sample(block_permutations[1:], max(int(perc*len(block_permutations)), 1))
-            n_reorderings = len(block_permutations)
-            total_progs = len(bin_ops_2_swap)*len(if_elses_2_swap)*len(inc_ops_2_swap)*len(range(1, dv_limit, -1))*n_reorderings*len(fors_2_swap)
-            perc = perc*0.9
-            min_per_mutation = 1 if min_per_mutation == 1 else min_per_mutation - 1
-
-            if args.verbose:
-                print()
-                print("Number of Programs with BinOps swapped:", len(bin_ops_2_swap))
-                print("Number of Programs with if-statements swapped:", len(if_elses_2_swap))
-                print("Number of Programs with swapped increment operators:", len(inc_ops_2_swap))
-                print("Number of Programs with for translated 2 whiles loops:", len(fors_2_swap))
-                print(" Number of blocks reorders:", n_reorderings)
-
-        if args.verbose:
-            print("\n\nNumber of possible reorderings (Sampled):", n_reorderings)
-            total_progs = len(bin_ops_2_swap)*len(if_elses_2_swap)*len(inc_ops_2_swap)*len(range(1, dv_limit, -1))*n_reorderings*len(fors_2_swap)
-            print("#Total number of programs (Sampled):", total_progs)
-            print()
-
-    total_progs = len(bin_ops_2_swap)*len(if_elses_2_swap)*len(inc_ops_2_swap)*len(range(1, dv_limit, -1))*n_reorderings*len(fors_2_swap)
+    num_progs = get_num_progs(total_progs, args)
+    if args.verbose and num_progs < total_progs:
+        print("#Total number of programs (Sampled):", num_progs)
+        print()
+
     if args.info:
         #Total number of programs:"
         os.system("rm "+output_file)
-        return total_progs
-    # print(bin_numbers)
-    var_maps = dict()
-    prev_nums = list()
-    for bops_n, bops_l in bin_ops_2_swap:
-        # print(bops_n, bops_l)
-        for bifs_n, bifs_l in if_elses_2_swap:
-            for biops_n, biops_l in inc_ops_2_swap:
-                for dummy_var in range(1, dv_limit, -1): # declaring new dummy variable
-                    for b in range(n_reorderings):
-                        for bfors_n, bfors_l in fors_2_swap:
-                            block_bin =  binary_repr(b, width=len(binary_repr(n_reorderings)))
-                            b_ast = parse_file(output_file, use_cpp=True, cpp_path='gcc', cpp_args=['-E', '-Iutils/fake_libc_include'])
-                            prev_nums.append(get_prog_name(bops_n, bifs_n, biops_n, dummy_var, block_bin, bfors_n))
-                            curr_num = prev_nums[-1]
-                            if args.comp_ops or args.all_mut:
-                                v_h = SwapBinOpsVisitor(list(bops_l))
-                                b_ast = v_h.visit(b_ast)
-                                var_maps[curr_num] = v.scope_vars
-                                # if args.verbose:
-                                #     print("SwapBinOpsVisitor done")
-                            if args.if_else or args.all_mut:
-                                v_h = SwapIfElseVisitor(list(bifs_l), v.if_2_swap_ids)
-                                b_ast = v_h.visit(b_ast)
-                                var_maps[curr_num] = v.scope_vars
-                                # if args.verbose:
-                                #     print("SwapIfElseVisitor done")
-                            if args.incr_ops or args.all_mut:
-                                v_h = SwapIncrDecrOpsVisitor(list(biops_l), v.inc_ops_2_swap_ids)
-                                b_ast = v_h.visit(b_ast)
-                                var_maps[curr_num] = v.scope_vars
-                                # if args.verbose:
-                                #     print("SwapIncrDecrOpsVisitor done")
-                            if (args.reord_decls or args.all_mut) and block_permutations[b]!=[]:
-                                # we need to verify if the program has no variables
-                                v_h = ReorderVarDeclsVisitor(block_permutations[b])
-                                b_ast = v_h.visit(b_ast)
-                                var_maps[curr_num] = v.scope_vars
-                                # if args.verbose:
-                                #     print("ReorderVarDeclsVisitor done")
-                            if args.for_2_while or args.all_mut:
-                                v_h = For2WhileVisitor(list(bfors_l), v.for_ids_2_swap)
-                                b_ast = v_h.visit(b_ast)
-                                var_maps[curr_num] = v.scope_vars
-                                # if args.verbose:
-                                #     print("For2WhileVisitor done")
-                            if args.dummy_var or args.all_mut:
-                                v_h = DeclDumVarVisitor(v.scope_vars, True if dummy_var == 1 else False)
-                                b_ast = v_h.visit(b_ast)
-                                v2 = MutatorVisitor()
-                                n_ast = v2.visit(b_ast)
-                                var_maps[curr_num] = v2.scope_vars
-                                # if args.verbose:
-                                #     print("DeclDumVarVisitor done")
-
-                            gen_output_file(gen, b_ast, sincludes + includes, curr_num, output_dir)
-                            gen_variable_mappings(var_maps, curr_num, prev_nums, output_dir)
+        return num_progs, None
+
+    progs_2_gen = get_progs_2_gen(mutations_space, num_progs, args, rng)
+    sink = get_output_sink(output_dir, args, "".join(sincludes + includes) + c_generator.CGenerator().visit(original_ast))
+    duplicates = DuplicateFilter()
+    for curr_num, mutation_vector, str_ast, mappings in gen_mutated_programs(original_ast, v, mutations_space, progs_2_gen, args):
+        original = duplicates.get_original(curr_num, str_ast) if args.dedup else None
+        if original is not None:
+            sink.add_alias(curr_num, original, mutation_vector)
+            continue
+        write_output_file(str_ast, sincludes + includes, curr_num, sink, mutation_vector)
+        for kind, (p_name, mapping) in mappings.items():
+            sink.add_mapping(kind, p_name, mapping)
         
+    sink.close()
     os.system("rm "+output_file)
+    if args.dedup and args.verbose:
+        print("Number of duplicated programs skipped:", duplicates.num_duplicates)
+    return None, duplicates.num_duplicates if args.dedup else None
+
+def get_config(**options):
+    # the configuration of the mutator used by mutate, i.e. the default values of the command line options overridden by options
+    # e.g. get_config(comp_ops=True, enumerate_all=True)
+    config = parser([])
+    for k, value in options.items():
+        if not hasattr(config, k):
+            raise ValueError("Unknown option of the mutator: {k}".format(k=k))
+        setattr(config, k, value)
+    return config
+
+def analyse_source(source, config):
+    # parses and analyses the program in the string source, returns its includes and its analysis (or None if it can not be parsed)
+    sincludes, includes, noincludes = split_includes(io.StringIO(source).readlines())
+    code = get_program_code(sincludes, includes, noincludes)
+    cache = get_analysis_cache(config.cache_dir, config.cache_size*2**20, "mutator") if config.cache_dir else None
+    key = cache.get_source_key(code.encode()) if cache else None
+    analysis = cache.get(key) if cache else None
+    if analysis is None:
+        analysis = analyse_program("<string>", sincludes, includes, code)
+        if analysis is None:
+            return None
+        if cache:
+            cache.put(key, analysis)
+    return "".join(sincludes + includes), analysis
+
+def mutate(source, config=None, num_progs=None, analysed=None, skip_original=False):
+    # Generator of the mutated programs of the program in the string source, without writing any file.
+    # Yields tuples with the code of each mutated program, its mapping of variables to the first program generated (the original program)
+    # and its mutation vector. config is given by get_config, and its options about the input and the output of the mutator are ignored.
+    # num_progs is the number of programs sampled, instead of the number given by the options. The callers that mutate the same program
+    # several times can give the result of analyse_source (analysed), so the program is only parsed once. Nothing is yielded if the program can not be parsed.
+    # With skip_original, the original program is still generated (the variable mappings refer to it) but not yielded, nor counted in num_progs.
+    config = get_config() if config is None else config
+    analysed = analyse_source(source, config) if analysed is None else analysed
+    if analysed is None:
+        return
+    includes, (original_ast, v) = analysed
+    rng = get_program_random(config, None, source)
+    mutations_space = get_mutations_space(v, config)
+    if num_progs is None:
+        num_progs = get_num_progs(mutations_space.size, config)
+    if skip_original:
+        num_progs += 1
+    progs_2_gen = get_progs_2_gen(mutations_space, min(num_progs, mutations_space.size), config, rng)
+    duplicates = DuplicateFilter()
+    programs = gen_mutated_programs(original_ast, v, mutations_space, progs_2_gen, config)
+    for i, (curr_num, mutation_vector, str_ast, mappings) in enumerate(programs):
+        if config.dedup and duplicates.get_original(curr_num, str_ast) is not None:
+            continue
+        # the original program is always the first program generated
+        if skip_original and i == 0:
+            continue
+        yield includes + str_ast, mappings["var_map"][1], mutation_vector
     
 #-----------------------------------------------------------------
 
+def init_worker(a):
+    # the worker processes need the users' arguments to mutate the programs
+    global args
+    args = a
+
+def get_stu_id(p):
+    np = str(p)
+    if "/" in np:
+        np = np.split("/")[-1]
+    return np.split("-")[1] if "-" in np else np.replace(".c", "")
+
+def mutate_program(p, output_dir):
+    stu_id = get_stu_id(p)
+    if args.verbose and args.jobs == 1:
+        print("Dealing with student ", stu_id)
+    # the files of an interrupted run are removed
+    if os.path.exists(output_dir+"/"+stu_id):
+        shutil.rmtree(output_dir+"/"+stu_id)
+    rng = get_program_random(args, p)
+    # try:
+    s_muts = instrument_file(p, output_dir+"/"+stu_id, rng)
+    # except:
+    #     return stu_id, None
+    return stu_id, s_muts
+
 def gen_program_mutations(progs_dir, output_dir):
     total_progs = 0
-    progs = list(pathlib.Path(progs_dir).glob('*.c'))
+    total_duplicates = 0
+    progs = sorted(pathlib.Path(progs_dir).glob('*.c'))
+    # the programs of each student are written to the directory of its id (e.g. x-123.c and y-123.c to 123),
+    # so the programs with the same id would remove each other's programs
+    stu_progs = dict()
+    for p in progs:
+        if get_stu_id(p) in stu_progs:
+            exit("The programs {p1} and {p2} have the same student id ({s})!".format(p1=stu_progs[get_stu_id(p)].name, p2=p.name, s=get_stu_id(p)))
+        stu_progs[get_stu_id(p)] = p
+    # the programs already mutated with the same arguments by a previous run are skipped
+    manifest = Manifest(output_dir, get_run_flags(args))
+    progs_hashes = dict()
+    progs_2_mutate = []
     for p in progs:
-        np = str(p)
-        if "/" in np:
-            np = np.split("/")[-1]
-        stu_id = np.split("-")[1] if "-" in np else np.replace(".c", "")
-        if args.verbose:
-            print("Dealing with student ", stu_id)
-        # try:
-        s_muts = instrument_file(p, output_dir+"/"+stu_id)
-        # except:
-        #     continue
-        s_muts = instrument_file(p, output_dir+"/"+stu_id)
-        if args.info and s_muts is not None:
-           total_progs += s_muts
+        progs_hashes[p] = file_hash(p)
+        entry = manifest.get_entry(p.name, progs_hashes[p], output_dir+"/"+get_stu_id(p))
+        if entry is None:
+            progs_2_mutate.append(p)
+        else:
+            if args.info and entry["num_progs"] is not None:
+                total_progs += entry["num_progs"]
+            if args.dedup and entry["duplicates"] is not None:
+                total_duplicates += entry["duplicates"]
+    if args.verbose and len(progs_2_mutate) < len(progs):
+        print("Skipping {n} students already mutated".format(n=len(progs)-len(progs_2_mutate)))
+    n_done = 0
+    results = run_jobs(partial(mutate_program, output_dir=output_dir), progs_2_mutate, args.jobs, init_worker, (args,))
+    for p, (stu_id, (num_progs, num_duplicates)) in zip(progs_2_mutate, results):
+        n_done += 1
+        manifest.add_entry(p.name, progs_hashes[p], output_dir+"/"+stu_id, num_progs, num_duplicates)
+        if args.verbose and args.jobs != 1:
+            print("[{i}/{n}] Student {s} done".format(i=n_done, n=len(progs_2_mutate), s=stu_id))
+        if args.info and num_progs is not None:
+           total_progs += num_progs
+        if args.dedup and num_duplicates is not None:
+           total_duplicates += num_duplicates
+    if args.dedup and not args.info:
+        print("Duplicated programs skipped:", total_duplicates)
     if args.info:
         print(total_progs)
-        os.system("rm -rf "+output_dir)
+        # only the manifest is kept, so the counts are not computed again
+        for p in progs:
+            if os.path.exists(output_dir+"/"+get_stu_id(p)):
+                shutil.rmtree(output_dir+"/"+get_stu_id(p))
         
     
 #-----------------------------------------------------------------
 
-def parser():
+def parser(arguments=None):
     parser = argparse.ArgumentParser(prog='prog_mutator.py', formatter_class=argparse.RawTextHelpFormatter)
-    parser.add_argument('-c', '--comp_ops', action='store_true', default=False, help='Swaps the comparison operators.')
-    parser.add_argument('-if', '--if_else', action='store_true', default=False, help='Swaps the simple if-else-statements.')
-    parser.add_argument('-io', '--incr_ops', action='store_true', default=False, help='Swaps the increment operators (e.g. i++, ++i and i+=1) if these are not used in a binary operation or in an assignment.')
-    parser.add_argument('-dv', '--dummy_var', action='store_true', default=False, help='Declares a dummy variable in the beginning of the main function.')
-    parser.add_argument('-rd', '--reord_decls', action='store_true', default=False, help='Reorder the order of variable declarations, when it is possible i.e., when two variables\' declarations do not depend on each other')
-    parser.add_argument('-fw', '--for_2_while', action='store_true', default=False, help='Translates simple for-loops (without any continue instruction) into a while-loop.')
+    for m in mutations:
+        parser.add_argument(m.flag, '--'+m.name, action='store_true', default=False, help=m.help)
     parser.add_argument('-a', '--all_mut', action='store_true', default=False, help='Performs all the mutations above.')
     parser.add_argument('-p', '--percentage_total_progs', type=float, help='Instead of generating all possible mutations the script only generates this percentage. Default 0.01 if the total number of possible mutations is higher than 100k or 0.1 otherwise.')
+    parser.add_argument('-q', '--quota', type=int, help='When only a sample of the mutated programs is generated, the minimum number of sampled programs in which each of the mutations above is applied. The quotas are reduced, evenly between the mutations, when they do not fit in the sampled programs.')
     parser.add_argument('-d', '--input_dir', help='Name of the input directory.')
     parser.add_argument('-o', '--output_dir', help='Name of the output directory.')
     parser.add_argument('-info', '--info', action='store_true', default=False, help='Prints the total number of programs the required mutations can produced and exits without producing the sets of programs.')
     parser.add_argument('-ea', '--enumerate_all', action='store_true', default=False, help='Enumerates all possible mutated programs. NOTE: Sometimes the number of mutated programs is more than 200K Millions of programs.')
+    parser.add_argument('-j', '--jobs', type=int, default=1, help='Number of programs mutated in parallel by a pool of worker processes. Use 0 for one worker per core. (Default = 1).')
+    parser.add_argument('-sd', '--seed', type=int, help='Seed of the sampling of the mutated programs. Each program is sampled with its own seed, so resumed runs generate the same programs. (Default = no seed).')
+    parser.add_argument('-ar', '--archive', action='store_true', default=False, help='Writes the mutated programs of each student and their variable mappings to a single zip archive ('+archive_name+') instead of one file each.')
+    parser.add_argument('-ds', '--dataset', action='store_true', default=False, help='Writes the mutated programs of each student, their mutations and variable mappings as the rows of a single gzipped JSON Lines file ('+dataset_name+') instead of one file each.')
+    parser.add_argument('-pt', '--patches', action='store_true', default=False, help='Writes the original program of each student to '+original_name+', and the edits that turn it into each of the mutated programs, together with their variable mappings, as the rows of a single gzipped JSON Lines file ('+patches_name+') instead of one file each. The programs are rebuilt with apply_patches.py.')
+    parser.add_argument('-vi', '--var_maps', action='store_true', default=False, help='Writes the variable mappings of the mutated programs of each student to a single file ('+var_maps_name+'), where each distinct mapping is stored once and referenced by its index, instead of one file each. The mappings are read with helper.read_var_maps. Ignored with -ds and -pt.')
+    parser.add_argument('-dd', '--dedup', action='store_true', default=False, help='Skips the mutated programs whose code is the same as a program already generated for the same student, and prints how many were skipped. The skipped programs are listed in '+aliases_name+' (or as rows with "alias_of" in the dataset).')
+    parser.add_argument('-cd', '--cache_dir', help='Directory where the ASTs of the programs and their analysis are cached between runs. (Default = no cache).')
+    parser.add_argument('-cs', '--cache_size', type=int, default=1024, help='Maximum size of the cache in MB, the least recently used programs are removed first. (Default = 1024).')
     parser.add_argument('-v', '--verbose', action='store_true', default=False, help='Prints debugging information.')
-    args = parser.parse_args(argv[1:])
+    args = parser.parse_args(argv[1:] if arguments is None else arguments)
     return args
 
 
@@ -12,19 +12,21 @@
 from __future__ import print_function
 import sys, os
 import re
-from copy import deepcopy
 import argparse
 from sys import argv
+import shutil
 from shutil import copyfile
-from topological_sorting import getTopologicalOrders
 
-from itertools import product, combinations, chain
+from itertools import combinations, chain, islice
+from functools import partial
 from numpy import binary_repr
+import numpy as np
 import pickle
 import gzip
 import pathlib
 
 import random
+from math import comb
 
 # This is not required if you've installed pycparser into
 # your site-packages/ with setup.py
@@ -44,8 +46,14 @@ class MutilatorVisitor(c_ast.NodeVisitor):
     def __init__ (self):
         # list with the program variables
         self.scope_vars = dict()
-        # number of binary operations to swap
+        # integer ids of the nodes, in the order they are visited
+        self.ids = NodeIds()
+        # ids of the binary operations to swap
         self.bin_ops_2_swap = list()
+        # the nodes of the mutilated AST where each mutilation can be applied: binary operations by id, identifiers and assignments by node_repr
+        self.bin_op_nodes = dict()
+        self.id_nodes = dict()
+        self.assignment_nodes = dict()
         # list of bugs introduced
         self.bugs_list = dict()
         # inside a declaration flag
@@ -113,6 +121,7 @@ class MutilatorVisitor(c_ast.NodeVisitor):
         if not self.inside_declaration:
             node_info = node_repr(node.coord)
             self.possible_assignment_deletion.append(node_info)
+            self.assignment_nodes.setdefault(node_info, []).append(node)
         node.rvalue = self.visit(node.rvalue)
         node.lvalue = self.visit(node.lvalue)
         return node
@@ -134,6 +143,7 @@ class MutilatorVisitor(c_ast.NodeVisitor):
 
             if var_misuses != []:
                 self.possible_variable_misuses.append(var_misuses)
+                self.id_nodes.setdefault(node_info, []).append(node)
                 
         return node
 
@@ -156,15 +166,17 @@ class MutilatorVisitor(c_ast.NodeVisitor):
     def visit_BinaryOp(self, node):
         # print('****************** Found Binary Operation *******************')
         # print(node.show())
+        bin_op_id = self.ids.new_id("BinaryOp")
         left = self.visit(node.left)
         right = self.visit(node.right)
+        n_bin_op = c_ast.BinaryOp(node.op, left, right, node.coord)
         if node.op in bin_ops_2_swap.keys():
-            self.bin_ops_2_swap.append(node_id(node.coord))
-        return c_ast.BinaryOp(node.op, left, right, node.coord)
+            self.bin_ops_2_swap.append(bin_op_id)
+            self.bin_op_nodes[bin_op_id] = n_bin_op
+        return n_bin_op
 
     def visit_TernaryOp(self, node):
         # print('****************** Found Ternary Op Node *******************')
-        if_id = node_id(node.coord)
         n_cond = self.visit(node.cond)
         n_iftrue = self.visit(node.iftrue)
         n_iffalse = node.iffalse
@@ -222,7 +234,6 @@ class MutilatorVisitor(c_ast.NodeVisitor):
 
     def visit_If(self, node):
         #print('****************** Found IF Node *******************')
-        if_id = node_id(node.coord)
         n_cond = self.visit(node.cond)
         if isinstance(node.iftrue, c_ast.Compound):
             n_iftrue = self.visit(node.iftrue)
@@ -238,7 +249,6 @@ class MutilatorVisitor(c_ast.NodeVisitor):
 
     def visit_For(self, node):
         # print('****************** Found For Node *******************')
-        for_id = node_id(node.coord)
         n_init = self.visit(node.init)
         n_cond = self.visit(node.cond)
         if not isinstance(node.stmt, c_ast.Compound):
@@ -251,7 +261,6 @@ class MutilatorVisitor(c_ast.NodeVisitor):
 
     def visit_While(self, node):
         #print('****************** Found While Node *******************')
-        while_id = node_id(node.coord)
         n_cond = self.visit(node.cond)
         n_stmt = self.visit(node.stmt)
         n_while = c_ast.While(c_ast.ExprList([n_cond]), n_stmt, node.coord)
@@ -266,69 +275,89 @@ class MutilatorVisitor(c_ast.NodeVisitor):
         return node
     
 #-----------------------------------------------------------------
-# A visitor that swaps the comparison operators of simple binary comparisons >, < <=, >=
-class SwapBinOpsVisitor(MutilatorVisitor):
-
-    def __init__ (self, bin_ops_2_swap_ids):
-        super().__init__()
-        # bin_ops_2_swap is a list of booleans that says if each binary operation is to swap or not
-        self.bin_ops_2_swap_ids = bin_ops_2_swap_ids
-        
-    def visit(self, node):
-        return MutilatorVisitor.visit(self, node)
-
-    def visit_BinaryOp(self, node):
-        # print('****************** Found Binary Operation *******************')
-        # print(node.show())
-        left = self.visit(node.left)
-        right = self.visit(node.right)
-        if node.op in bin_ops_2_swap.keys() and node_id(node.coord) in self.bin_ops_2_swap_ids:
-            self.bugs_list[node_repr(node.coord)] = ("BinaryOp-"+node.op, "BinaryOp-"+bin_ops_2_swap[node.op])
-            return c_ast.BinaryOp(bin_ops_2_swap[node.op], left, right, node.coord)
-        return c_ast.BinaryOp(node.op, left, right, node.coord)
-
-#-----------------------------------------------------------------
-# A visitor that introduces a bug of variable misuse i.e., changes the name of some variable occurrence by another variable's identifier
-class VariableMisuseVisitor(MutilatorVisitor):
-    def __init__ (self, var_2_misused):
-        super().__init__()
-        self.var_2_misused, self.new_var = var_2_misused
-        
-    def visit(self, node):
-        return MutilatorVisitor.visit(self, node)
-
-    def visit_ID(self, node):
-        #print('****************** Found ID Node *******************')
-        node_info = node_repr(node.coord)
-        if node_info == self.var_2_misused:
-            self.bugs_list[node_repr(node.coord)] = ("VarMisuse-"+node.name, "VarMisuse-"+self.new_var)
-            node.name = self.new_var
-                
-        return node
-
-#-----------------------------------------------------------------
-#A visitor that introduces the bug of a missing expression in the program in our case we delete assignments that are not related to variables' declarations 
-class AssignmentDeletionVisitor(MutilatorVisitor):
-    def __init__ (self, expr_2_delete):
-        super().__init__()
-        self.expr_2_delete = expr_2_delete
-        
-    def visit(self, node):
-        return MutilatorVisitor.visit(self, node)
+# A reversible in-place change to the AST of the correct program i.e., sets a field of a node (or a position of a list of nodes) to a new value.
+# The mutilations are applied as patches and undone once the program is generated, so the AST is never copied.
+class Patch:
+
+    def __init__ (self, node, field, value):
+        self.node = node
+        self.field = field
+        self.value = value
+        self.old_value = None
+
+    def apply(self):
+        if isinstance(self.node, list):
+            self.old_value = self.node[self.field]
+            self.node[self.field] = self.value
+        else:
+            self.old_value = getattr(self.node, self.field)
+            setattr(self.node, self.field, self.value)
+        return self
 
-    def visit_Assignment(self, node):
-        # print('****************** Found Assignment Node *******************')
-        node_info = node_repr(node.coord)
-        if node_info == self.expr_2_delete:
-            self.bugs_list[node_info] = ("AssignmentDeletion",str(node))
-            return None
-        node.rvalue = self.visit(node.rvalue)
-        node.lvalue = self.visit(node.lvalue)
-        return node
+    def undo(self):
+        if isinstance(self.node, list):
+            self.node[self.field] = self.old_value
+        else:
+            setattr(self.node, self.field, self.old_value)
+
+def get_changed_nodes(patches, parent_nodes):
+    # the ids of the nodes whose code is changed by the patches i.e., the nodes patched and their ancestors (see MemoCGenerator)
+    changed = set()
+    for p in patches:
+        # the lists of nodes are not nodes themselves, their node is the parent of the node replaced
+        node = p.old_value if isinstance(p.node, list) else p.node
+        while node is not None and id(node) not in changed:
+            changed.add(id(node))
+            node = parent_nodes.get(id(node))
+    return changed
+
+def get_parents(ast):
+    # maps the id of each node of the AST to the node (or list of nodes) and the field where it is stored
+    parents = dict()
+    stack = [ast]
+    while stack != []:
+        node = stack.pop()
+        for name, child in node.children():
+            if child is None:
+                continue
+            if name.endswith("]"):
+                field, i = name[:-1].split("[")
+                parents[id(child)] = (getattr(node, field), int(i))
+            else:
+                parents[id(child)] = (node, name)
+            stack.append(child)
+    return parents
+
+# Swaps the comparison operators of simple binary comparisons >, < <=, >=
+def swap_bin_ops(v, bin_op_ids, bugs_list):
+    patches = []
+    for bin_op_id in bin_op_ids:
+        node = v.bin_op_nodes[bin_op_id]
+        bugs_list[node_repr(node.coord)] = ("BinaryOp-"+node.op, "BinaryOp-"+bin_ops_2_swap[node.op])
+        patches.append(Patch(node, "op", bin_ops_2_swap[node.op]).apply())
+    return patches
+
+# Introduces a bug of variable misuse i.e., changes the name of some variable occurrence by another variable's identifier
+def misuse_variable(v, var_2_misused, bugs_list):
+    patches = []
+    node_info, new_var = var_2_misused
+    for node in v.id_nodes.get(node_info, []):
+        bugs_list[node_info] = ("VarMisuse-"+node.name, "VarMisuse-"+new_var)
+        patches.append(Patch(node, "name", new_var).apply())
+    return patches
+
+# Introduces the bug of a missing expression in the program in our case we delete assignments that are not related to variables' declarations
+def delete_assignment(v, parents, expr_2_delete, bugs_list):
+    patches = []
+    for node in v.assignment_nodes.get(expr_2_delete, []):
+        bugs_list[expr_2_delete] = ("AssignmentDeletion",str(node))
+        parent, field = parents[id(node)]
+        patches.append(Patch(parent, field, None).apply())
+    return patches
 
 #-----------------------------------------------------------------
 
-def gen_variable_mappings(var_maps, bn, corr_impl_id, output_dir):
+def get_variable_mapping(var_maps, bn, corr_impl_id):
     var_dict = dict()
     other_d = var_maps[corr_impl_id]   # the correct program
     d = var_maps[bn]
@@ -344,34 +373,133 @@ def gen_variable_mappings(var_maps, bn, corr_impl_id, output_dir):
         elif v not in other_d.keys() and v not in var_dict.keys():
             var_dict["UnkVar"] = v
 
-    p_name = output_dir+'/var_map-{bn1}_{bn2}.pkl.gz'.format(bn1=corr_impl_id, bn2=bn)
-    fp=gzip.open(p_name,'wb')
-    pickle.dump(var_dict,fp)
-    fp.close()
+    p_name = 'var_map-{bn1}_{bn2}.pkl.gz'.format(bn1=corr_impl_id, bn2=bn)
+    return p_name, var_dict
 
-def save_bugs_map(bugs_maps, bn, corr_impl_id, output_dir):
-    p_name = output_dir+'/bug_map-{bn1}-{bn2}.pkl.gz'.format(bn1=corr_impl_id, bn2=bn)
-    fp=gzip.open(p_name,'wb')
-    pickle.dump(bugs_maps[bn],fp)
-    fp.close()
-    
-def get_prog_name(bops, var_mu, exp_del):
-    # based on the users' arguments the name of the program will contain information about the mutations required
-    p_name = ""
-    p_name = bops+"-" if args.comp_ops or args.all_mut else p_name
-    p_name = p_name+var_mu+"-" if args.var_mu or args.all_mut else p_name
-    p_name = p_name+exp_del+"-" if args.asg_del or args.all_mut else p_name
-    return p_name[:-1]
+def get_bugs_map(bugs_maps, bn, corr_impl_id):
+    p_name = 'bug_map-{bn1}-{bn2}.pkl.gz'.format(bn1=corr_impl_id, bn2=bn)
+    return p_name, bugs_maps[bn]
+
+#-----------------------------------------------------------------
+# The bugs of the mutilated programs as the columns of a table, with a row per bug: the student, the program, the line and the column of the bug,
+# its kind, and the code before and after the bug (e.g. the operators swapped, or the assignment deleted). The strings are stored once,
+# and the columns only hold their indexes, so the table is a few integer arrays written in a single numpy file.
+# Each student gets its own table (bugs_name), and the tables of all the students are joined in a single one at the end of each run (bug_index_name).
+
+bugs_name = 'bugs.npz'
+bug_index_name = 'bug_index.npz'
+bug_columns = ["student", "program", "line", "column", "kind", "before", "after"]
+bug_kinds = ["BinaryOp", "VarMisuse", "AssignmentDeletion"]
+# the names of the kinds of bugs in README.md
+bug_kinds_codes = {"B1" : "BinaryOp", "WCO" : "BinaryOp", "B2" : "VarMisuse", "VM" : "VarMisuse", "B3" : "AssignmentDeletion", "AD" : "AssignmentDeletion"}
+
+class BugIndex:
+
+    def __init__ (self):
+        # the index of each string, and the values of each column
+        self.names = dict()
+        self.columns = {c : [] for c in bug_columns}
+
+    def get_name_id(self, name):
+        return self.names.setdefault(name, len(self.names))
+
+    def add_bugs(self, student, program, bugs_map):
+        # the bugs of a bug map (see get_bugs_map) e.g. {"l12-c5" : ("BinaryOp-<", "BinaryOp-<=")}
+        for node_info, (before, after) in bugs_map.items():
+            line, column = node_info[1:].split("-c")
+            kind, _, before = before.partition("-")
+            if kind == "AssignmentDeletion":
+                # the assignment deleted is the code before the bug
+                before, after = after, ""
+            else:
+                after = after.partition("-")[2]
+            row = [self.get_name_id(student), self.get_name_id(program), int(line), int(column), bug_kinds.index(kind),
+                   self.get_name_id(before), self.get_name_id(after)]
+            for c, x in zip(bug_columns, row):
+                self.columns[c].append(x)
+
+    def add_index(self, index):
+        # the bugs of an index already written (see load_bug_index)
+        names_ids = np.array([self.get_name_id(str(n)) for n in index["names"]], dtype=np.int32)
+        for c in bug_columns:
+            values = names_ids[index[c]] if c in ["student", "program", "before", "after"] else index[c]
+            self.columns[c].extend(values.tolist())
+
+    def save(self, file_name):
+        columns = {c : np.array(self.columns[c], dtype=np.int8 if c == "kind" else np.int32) for c in bug_columns}
+        np.savez_compressed(file_name, names=np.array(list(self.names.keys()), dtype=str), **columns)
+
+def load_bug_index(file_name):
+    # the arrays of an index written by BugIndex, by their name
+    with np.load(file_name) as data:
+        return {k : data[k] for k in data.files}
+
+def query_bugs(index, kind=None, student=None, program=None, line=None):
+    # The bugs of an index (see load_bug_index) of the given kind (e.g. "VarMisuse" or "B2"), student, program and line, as dicts with a value for each column.
+    # e.g. query_bugs(load_bug_index("lab03/ex2/bug_index.npz"), kind="VM")
+    names = index["names"]
+    rows = np.ones(len(index["line"]), dtype=bool)
+    if kind is not None:
+        rows &= index["kind"] == bug_kinds.index(bug_kinds_codes.get(kind, kind))
+    for c, value in [("student", student), ("program", program)]:
+        if value is not None:
+            rows &= np.isin(index[c], np.flatnonzero(names == value))
+    if line is not None:
+        rows &= index["line"] == line
+    bugs = []
+    for i in np.flatnonzero(rows):
+        bugs.append({"student" : str(names[index["student"][i]]), "program" : str(names[index["program"][i]]), "line" : int(index["line"][i]),
+                     "column" : int(index["column"][i]), "kind" : bug_kinds[index["kind"][i]],
+                     "before" : str(names[index["before"][i]]), "after" : str(names[index["after"][i]])})
+    return bugs
+
+def join_bug_indexes(file_names, output_file):
+    # writes the bugs of several indexes (e.g. of all the students) to a single index
+    bug_index = BugIndex()
+    for f in file_names:
+        bug_index.add_index(load_bug_index(f))
+    bug_index.save(output_file)
+
+def get_mutilation_vector(bops, var_mu, exp_del, config):
+    # the mutilations applied to the program, for each of the mutilations required by the user
+    vector = dict()
+    if config.comp_ops or config.all_mut:
+        vector["comp_ops"] = bops
+    if config.var_mu or config.all_mut:
+        vector["var_mu"] = var_mu
+    if config.asg_del or config.all_mut:
+        vector["asg_del"] = exp_del
+    return vector
+
+def get_prog_name(mutilation_vector):
+    # based on the users' arguments the name of the program will contain information about the mutilations required
+    return "-".join(mutilation_vector.values())
     
-def instrument_file(input_file, output_dir):
-    output_file, sincludes, includes = make_output_dir(input_file, output_dir)#, logfilename, loglibpath)
+def count_mutilated_programs(v, n_mutilations, config):
+    # closed form of the number of programs instrument_file generates, without building the combinations of mutilations
+    n_bin_ops = len(v.bin_ops_2_swap)
+    n_var_misuses = sum(len(vm) for vm in v.possible_variable_misuses)
+    n_asg_dels = len(v.possible_assignment_deletion)
+    # each set of mutilations also has the option of not mutilating the program
+    total_progs = 1
+    if config.comp_ops or config.all_mut:
+        k = min(n_mutilations, n_bin_ops)
+        total_progs *= 1 + (k if config.single else comb(n_bin_ops, k))
+    if config.var_mu or config.all_mut:
+        total_progs *= 1 + (min(n_mutilations, n_var_misuses) if config.single else n_var_misuses)
+    if config.asg_del or config.all_mut:
+        total_progs *= 1 + (min(n_mutilations, n_asg_dels) if config.single else n_asg_dels)
+    return total_progs
+
+def analyse_program(output_file, sincludes, includes, source=None):
     try:
-        ast = parse_file(output_file, use_cpp=True,
-            cpp_path='gcc',
-            cpp_args=['-E', '-Iutils/fake_libc_include'])
+        ast = parse_program(output_file, sincludes, includes, source)
     except:
-        return
+        return None
 
+    # the declarations of the headers before the fakestart function are never part of the mutilated programs
+    typedef_names = get_typedef_names(ast)
+    ast = CleanUpVisitor().visit(ast)
     # print('******************** INPUT FILE: ********************')
     v = c_ast.NodeVisitor()
     v.visit(ast)
@@ -379,53 +507,58 @@ def instrument_file(input_file, output_dir):
     # exit()
     # v = VariablesVisitor()
     v = MutilatorVisitor()
-    gen = c_generator.CGenerator ()
     n_ast = v.visit(ast)
-    original_ast=deepcopy(n_ast)
     # n_ast.show()
     # return
-    if args.verbose:
-        print()
-        print(input_file)
-        print("Variables :", v.scope_vars)
-        print("Number of BinOps of interest:", len(v.bin_ops_2_swap))
-        print("Number of possible locations where we can misuse variables", len(v.possible_variable_misuses))
-        print("Number of assignment expressions safe to delete:", len(v.possible_assignment_deletion))
-
-    n_mutilations = int(args.num_mut)    
+    return typedef_names, n_ast, v
+
+def check_num_mut(config):
+    # returns the error message if the user asks for more mutilations than the ones possible
+    if (config.var_mu or config.all_mut) and config.num_mut > 1:
+        return "Currently this program can only perform 1 mutilation per program for the variable misuse task. The user is asking for {m} mutilations!".format(m=config.num_mut)
+    return None
+
+def gen_mutilated_programs(typedef_names, n_ast, v, config, rng, progs_2_gen=None):
+    # Generator of the mutilated programs, as tuples with the name of the program, its mutilation vector, its code (without the includes)
+    # and its mappings (the name and the content of each one). The programs that do not parse are skipped.
+    # rng is the random generator of the program, used by the single option.
+    # progs_2_gen is an optional set with the indexes of the programs generated, in the order they are enumerated (0 is the correct program).
+    gen = MemoCGenerator()
+    parent_nodes = get_parent_nodes(n_ast)
+    # only the nodes of the original AST are reused, not the nodes of the patches
+    origins = get_ast_origins(n_ast)
+    validated_programs = dict()
+    n_mutilations = int(config.num_mut)
     bin_ops_2_swap = list([[]])
-    if args.comp_ops or args.all_mut:
-        if args.single:
-            bin_ops_2_swap += random.sample(v.bin_ops_2_swap, min(n_mutilations, len(v.bin_ops_2_swap)))
+    if config.comp_ops or config.all_mut:
+        if config.single:
+            bin_ops_2_swap += [[b] for b in rng.sample(v.bin_ops_2_swap, min(n_mutilations, len(v.bin_ops_2_swap)))]
         else:
             bin_ops_2_swap += list(combinations(v.bin_ops_2_swap, min(n_mutilations, len(v.bin_ops_2_swap))))
 
     variable_misuses = list([(None, None)]) # To generatre the correct program without any bug introduced as the first program
-    if args.var_mu or args.all_mut:
-        if args.num_mut > 1:
-            exit("Currently this program can only perform 1 mutilation per program for the variable misuse task. The user is asking for {m} mutilations!".format(m=args.num_mut))
+    if config.var_mu or config.all_mut:
         variable_misuses += list(chain(*v.possible_variable_misuses))
-        if args.single:
-            variable_misuses = [(None,None)] + random.sample(variable_misuses[1:], min(n_mutilations, len(variable_misuses)))
+        if config.single:
+            variable_misuses = [(None,None)] + rng.sample(variable_misuses[1:], min(n_mutilations, len(variable_misuses)))
 
-        if args.verbose:
+        if config.verbose:
             print(" #Variable misuse possibilities: ", len(variable_misuses))
 
-    assignments_2_delete = list([[]])
-    if args.asg_del or args.all_mut:
-        if args.single:
-            assignments_2_delete += random.sample(v.possible_assignment_deletion, min(n_mutilations, len(v.possible_assignment_deletion)))
+    assignments_2_delete = list([None])
+    if config.asg_del or config.all_mut:
+        if config.single:
+            assignments_2_delete += rng.sample(v.possible_assignment_deletion, min(n_mutilations, len(v.possible_assignment_deletion)))
         else:
             assignments_2_delete += list(v.possible_assignment_deletion)
 
-    if args.info:
-        total_progs = len(bin_ops_2_swap)*len(variable_misuses)*len(assignments_2_delete)
-        return total_progs
-            
+    # the assignments to delete are replaced by None in their parent nodes
+    parents = get_parents(n_ast) if config.asg_del or config.all_mut else None
     var_maps = dict()
     prev_nums = list()
     bugs_map = dict()
     corr_impl_id = None
+    prog_index = -1
     for b in range(len(bin_ops_2_swap)):
         b_id = str(b).rjust(len(str(len(bin_ops_2_swap))), '0')
         for vm in range(len(variable_misuses)):
@@ -435,73 +568,264 @@ def instrument_file(input_file, output_dir):
                 exp = assignments_2_delete[ad]
                 exp_id = str(ad).rjust(len(str(len(assignments_2_delete))), '0')
                 # b_ast = parse_file(output_file, use_cpp=True, cpp_path='gcc', cpp_args=['-E', '-Iutils/fake_libc_include'])
-                prev_nums.append(get_prog_name(b_id, vm_id, exp_id))
+                mutilation_vector = get_mutilation_vector(b_id, vm_id, exp_id, config)
+                prev_nums.append(get_prog_name(mutilation_vector))
                 curr_num = prev_nums[-1]
-                n_ast=deepcopy(original_ast)
                 if corr_impl_id is None:
                     corr_impl_id = curr_num
-                if args.comp_ops or args.all_mut:
-                    v_h = SwapBinOpsVisitor(bin_ops_2_swap[b])
-                    b_ast = v_h.visit(n_ast)
-                    var_maps[curr_num] = v.scope_vars
-                    bugs_map[curr_num] = v_h.bugs_list
-                if args.var_mu or args.all_mut:
-                    v_h = VariableMisuseVisitor(var_misused)
-                    b_ast = v_h.visit(n_ast)
-                    var_maps[curr_num] = v.scope_vars
-                    if curr_num in bugs_map.keys():
-                        bugs_map[curr_num].update(v_h.bugs_list)
-                    else:
-                        bugs_map[curr_num] = v_h.bugs_list
-                if args.asg_del or args.all_mut:
-                    v_h = AssignmentDeletionVisitor(exp)
-                    b_ast = v_h.visit(n_ast)
-                    var_maps[curr_num] = v.scope_vars
-                    if curr_num in bugs_map.keys():
-                        bugs_map[curr_num].update(v_h.bugs_list)
-                    else:
-                        bugs_map[curr_num] = v_h.bugs_list
-                    
-                if args.verbose:
+                var_maps[curr_num] = v.scope_vars
+                prog_index += 1
+                if progs_2_gen is not None and prog_index not in progs_2_gen:
+                    continue
+                bugs_map[curr_num] = dict()
+                patches = []
+                if config.comp_ops or config.all_mut:
+                    patches += swap_bin_ops(v, bin_ops_2_swap[b], bugs_map[curr_num])
+                if config.var_mu or config.all_mut:
+                    patches += misuse_variable(v, var_misused, bugs_map[curr_num])
+                if config.asg_del or config.all_mut:
+                    patches += delete_assignment(v, parents, exp, bugs_map[curr_num])
+
+                if config.verbose:
                     print("Bug mapping:", curr_num, bugs_map[curr_num])
 
-                gen_output_file(gen, b_ast, sincludes + includes, curr_num, output_dir)
-                tmp_file = get_output_file_name(curr_num, output_dir)
-                try:
-                    ast = parse_file(tmp_file, use_cpp=True,
-                                         cpp_path='gcc',
-                                         cpp_args=['-E', '-Iutils/fake_libc_include'])
-                except:
-                    os.system("rm "+tmp_file)
+                str_ast = gen.generate(n_ast, origins, get_changed_nodes(patches, parent_nodes))
+                for p in reversed(patches):
+                    p.undo()
+                # some mutilations (e.g. deleting an assignment inside an expression) produce programs that do not parse
+                if not is_valid_program(str_ast, typedef_names, validated_programs):
                     continue
-                gen_variable_mappings(var_maps, curr_num, corr_impl_id, output_dir)
-                save_bugs_map(bugs_map, curr_num, corr_impl_id, output_dir)
+                mappings = {"var_map" : get_variable_mapping(var_maps, curr_num, corr_impl_id),
+                            "bug_map" : get_bugs_map(bugs_map, curr_num, corr_impl_id)}
+                yield curr_num, mutilation_vector, str_ast, mappings
+
+def instrument_file(input_file, output_dir, rng):
+    # returns the number of programs (with -info) and the number of duplicated programs skipped (with -dd), None otherwise
+    output_file, sincludes, includes = make_output_dir(input_file, output_dir)#, logfilename, loglibpath)
+    # the AST and the analysis of the programs already mutilated are read from the cache
+    cache = get_analysis_cache(args.cache_dir, args.cache_size*2**20, "mutilator") if args.cache_dir else None
+    key = cache.get_key(output_file) if cache else None
+    analysis = cache.get(key) if cache else None
+    if analysis is None:
+        analysis = analyse_program(output_file, sincludes, includes)
+        if analysis is None:
+            return None, None
+        if cache:
+            cache.put(key, analysis)
+    typedef_names, n_ast, v = analysis
+    if args.verbose:
+        print()
+        print(input_file)
+        print("Variables :", v.scope_vars)
+        print("Number of BinOps of interest:", len(v.bin_ops_2_swap))
+        print("Number of possible locations where we can misuse variables", len(v.possible_variable_misuses))
+        print("Number of assignment expressions safe to delete:", len(v.possible_assignment_deletion))
+
+    if args.info:
+        os.system("rm "+output_file)
+        return count_mutilated_programs(v, int(args.num_mut), args), None
+
+    sink = get_output_sink(output_dir, args, "".join(sincludes + includes) + c_generator.CGenerator().visit(n_ast))
+    # the bug maps are written to the bug index instead
+    bug_index = BugIndex() if args.bug_index else None
+    duplicates = DuplicateFilter()
+    for curr_num, mutilation_vector, str_ast, mappings in gen_mutilated_programs(typedef_names, n_ast, v, args, rng):
+        original = duplicates.get_original(curr_num, str_ast) if args.dedup else None
+        if original is not None:
+            sink.add_alias(curr_num, original, mutilation_vector)
+            continue
+        write_output_file(str_ast, sincludes + includes, curr_num, sink, mutilation_vector)
+        for kind, (p_name, mapping) in mappings.items():
+            if kind == "bug_map" and bug_index is not None:
+                bug_index.add_bugs(os.path.basename(output_dir), curr_num, mapping)
+            else:
+                sink.add_mapping(kind, p_name, mapping)
                 
+    sink.close()
+    if bug_index is not None:
+        bug_index.save(output_dir + '/' + bugs_name)
     os.system("rm "+output_file)
+    if args.dedup and args.verbose:
+        print("Number of duplicated programs skipped:", duplicates.num_duplicates)
+    return None, duplicates.num_duplicates if args.dedup else None
+
+def get_config(**options):
+    # the configuration of the mutilator used by mutilate, i.e. the default values of the command line options overridden by options
+    # e.g. get_config(var_mu=True, single=True)
+    config = parser([])
+    for k, value in options.items():
+        if not hasattr(config, k):
+            raise ValueError("Unknown option of the mutilator: {k}".format(k=k))
+        setattr(config, k, value)
+    return config
+
+def analyse_source(source, config):
+    # parses and analyses the program in the string source, returns its includes and its analysis (or None if it can not be parsed)
+    sincludes, includes, noincludes = split_includes(io.StringIO(source).readlines())
+    code = get_program_code(sincludes, includes, noincludes)
+    cache = get_analysis_cache(config.cache_dir, config.cache_size*2**20, "mutilator") if config.cache_dir else None
+    key = cache.get_source_key(code.encode()) if cache else None
+    analysis = cache.get(key) if cache else None
+    if analysis is None:
+        analysis = analyse_program("<string>", sincludes, includes, code)
+        if analysis is None:
+            return None
+        if cache:
+            cache.put(key, analysis)
+    return "".join(sincludes + includes), analysis
+
+def gen_random_progs(total_progs, rng):
+    # Generator of the indexes of the mutilated programs (1 to total_progs-1, 0 is the correct program) in a random order, drawn one at a time
+    # with the random generator rng
+    drawn = set()
+    while len(drawn) < total_progs-1:
+        if 2*len(drawn) >= total_progs:
+            # most programs were already drawn, the remaining ones are shuffled
+            remaining = [i for i in range(1, total_progs) if i not in drawn]
+            rng.shuffle(remaining)
+            yield from remaining
+            return
+        i = rng.randrange(1, total_progs)
+        if i not in drawn:
+            drawn.add(i)
+            yield i
+
+def mutilate(source, config=None, num_progs=None, analysed=None, random_order=False):
+    # Generator of the mutilated programs of the (correct) program in the string source, without writing any file.
+    # Yields tuples with the code of each mutilated program, its mapping of variables to the correct program, its mapping of bugs
+    # and its mutilation vector. config is given by get_config, and its options about the input and the output of the mutilator are ignored.
+    # num_progs is the maximum number of programs yielded. The callers that mutilate the same program several times can give the result of
+    # analyse_source (analysed), so the program is only parsed once. Nothing is yielded if the program can not be parsed.
+    # With random_order, the programs are drawn at random (with the seed of config) instead of yielded in the order they are enumerated,
+    # and the correct program is not yielded. It requires num_progs, and is ignored with the single option (whose programs are already random).
+    config = get_config() if config is None else config
+    if check_num_mut(config) is not None:
+        raise ValueError(check_num_mut(config))
+    analysed = analyse_source(source, config) if analysed is None else analysed
+    if analysed is None:
+        return
+    includes, (typedef_names, n_ast, v) = analysed
+    rng = get_program_random(config, None, source)
+    duplicates = DuplicateFilter()
+    if random_order and not config.single:
+        order = gen_random_progs(count_mutilated_programs(v, int(config.num_mut), config), rng)
+        # the programs are generated in batches of the ones still missing, since some of them do not parse or are duplicates
+        while num_progs > 0:
+            progs_2_gen = set(islice(order, num_progs))
+            if progs_2_gen == set():
+                return
+            for curr_num, mutilation_vector, str_ast, mappings in gen_mutilated_programs(typedef_names, n_ast, v, config, rng, progs_2_gen):
+                if config.dedup and duplicates.get_original(curr_num, str_ast) is not None:
+                    continue
+                num_progs -= 1
+                yield includes + str_ast, mappings["var_map"][1], mappings["bug_map"][1], mutilation_vector
+        return
+    for curr_num, mutilation_vector, str_ast, mappings in gen_mutilated_programs(typedef_names, n_ast, v, config, rng):
+        if num_progs is not None and num_progs <= 0:
+            return
+        if config.dedup and duplicates.get_original(curr_num, str_ast) is not None:
+            continue
+        if num_progs is not None:
+            num_progs -= 1
+        yield includes + str_ast, mappings["var_map"][1], mappings["bug_map"][1], mutilation_vector
+
+def get_mutilated_program(source, index, config=None, analysed=None):
+    # The mutilated program with the index given, in the order mutilate enumerates them (0 is the correct program, and negative indexes count
+    # from the last program, e.g. -1 is the program with the last mutilation of each kind). Only that program is generated.
+    # Returns a tuple as the ones yielded by mutilate, or None if the program can not be parsed, there is no such index or its program does not parse.
+    config = get_config() if config is None else config
+    if check_num_mut(config) is not None:
+        raise ValueError(check_num_mut(config))
+    analysed = analyse_source(source, config) if analysed is None else analysed
+    if analysed is None:
+        return None
+    includes, (typedef_names, n_ast, v) = analysed
+    total_progs = count_mutilated_programs(v, int(config.num_mut), config)
+    if index < 0:
+        index += total_progs
+    if index < 0 or index >= total_progs:
+        return None
+    rng = get_program_random(config, None, source)
+    for curr_num, mutilation_vector, str_ast, mappings in gen_mutilated_programs(typedef_names, n_ast, v, config, rng, {index}):
+        return includes + str_ast, mappings["var_map"][1], mappings["bug_map"][1], mutilation_vector
+    return None
     
 #-----------------------------------------------------------------
 
+def init_worker(a):
+    # the worker processes need the users' arguments to mutilate the programs
+    global args
+    args = a
+
+def get_stu_id(p):
+    return str(p).split("/")[-1][:-2] # to remove the .c
+
+def mutilate_program(p, output_dir):
+    stu_id = get_stu_id(p)
+    if args.verbose and args.jobs == 1:
+        print("Dealing with program ", stu_id)
+    new_dir = output_dir+"/"+stu_id
+    # the files of an interrupted run are removed
+    if os.path.exists(new_dir):
+        shutil.rmtree(new_dir)
+    rng = get_program_random(args, p)
+    s_mutils = instrument_file(p, new_dir, rng)
+    if len(list(pathlib.Path(new_dir).glob('tmp*'))) > 0:
+        os.system("rm -rf "+new_dir)
+    return stu_id, s_mutils
+
 def gen_program_mutilations(progs_dir, output_dir):
+    # checked once here, since the programs are mutilated by the worker processes
+    if check_num_mut(args) is not None:
+        exit(check_num_mut(args))
     total_progs = 0
-    progs = list(pathlib.Path(progs_dir).glob('*.c'))
-    progs = random.sample(progs, min(args.num_progs_2_process, len(progs)))
+    total_duplicates = 0
+    progs = sorted(pathlib.Path(progs_dir).glob('*.c'))
+    rng = random.Random(args.seed) if args.seed is not None else random
+    progs = rng.sample(progs, min(args.num_progs_2_process, len(progs)))
+    # the programs already mutilated with the same arguments by a previous run are skipped
+    manifest = Manifest(output_dir, get_run_flags(args))
+    progs_hashes = dict()
+    progs_2_mutilate = []
     for p in progs:
-        stu_id = str(p).split("/")[-1][:-2] # to remove the .c
-        if args.verbose:
-            print("Dealing with program ", stu_id)
-        new_dir = output_dir+"/"+stu_id
-        s_mutils = instrument_file(p, new_dir)
-        if len(list(pathlib.Path(new_dir).glob('tmp*'))) > 0:
-            os.system("rm -rf "+new_dir)
-        if args.info and s_mutils is not None:
-           total_progs += s_mutils
+        progs_hashes[p] = file_hash(p)
+        entry = manifest.get_entry(p.name, progs_hashes[p], output_dir+"/"+get_stu_id(p))
+        if entry is None:
+            progs_2_mutilate.append(p)
+        else:
+            if args.info and entry["num_progs"] is not None:
+                total_progs += entry["num_progs"]
+            if args.dedup and entry["duplicates"] is not None:
+                total_duplicates += entry["duplicates"]
+    if args.verbose and len(progs_2_mutilate) < len(progs):
+        print("Skipping {n} programs already mutilated".format(n=len(progs)-len(progs_2_mutilate)))
+    n_done = 0
+    results = run_jobs(partial(mutilate_program, output_dir=output_dir), progs_2_mutilate, args.jobs, init_worker, (args,))
+    for p, (stu_id, (num_progs, num_duplicates)) in zip(progs_2_mutilate, results):
+        n_done += 1
+        manifest.add_entry(p.name, progs_hashes[p], output_dir+"/"+stu_id, num_progs, num_duplicates)
+        if args.verbose and args.jobs != 1:
+            print("[{i}/{n}] Program {s} done".format(i=n_done, n=len(progs_2_mutilate), s=stu_id))
+        if args.info and num_progs is not None:
+           total_progs += num_progs
+        if args.dedup and num_duplicates is not None:
+           total_duplicates += num_duplicates
+    if args.dedup and not args.info:
+        print("Duplicated programs skipped:", total_duplicates)
     if args.info:
         print(total_progs)
-        os.system("rm -rf "+output_dir)
+        # only the manifest is kept, so the counts are not computed again
+        for p in progs:
+            if os.path.exists(output_dir+"/"+get_stu_id(p)):
+                shutil.rmtree(output_dir+"/"+get_stu_id(p))
+    elif args.bug_index:
+        # the bugs of all the programs, including the ones mutilated by a previous run
+        bugs_files = [output_dir+"/"+get_stu_id(p)+"/"+bugs_name for p in progs]
+        join_bug_indexes([f for f in bugs_files if os.path.exists(f)], output_dir+"/"+bug_index_name)
         
 #-----------------------------------------------------------------
 
-def parser():
+def parser(arguments=None):
     parser = argparse.ArgumentParser(prog='prog_mutilator.py', formatter_class=argparse.RawTextHelpFormatter)
     parser.add_argument('-c', '--comp_ops', action='store_true', default=False, help='Swaps the comparison operators.')
     parser.add_argument('-vm', '--var_mu', action='store_true', default=False, help='Introduces a bug of variable misuse.')
@@ -513,8 +837,18 @@ def parser():
     parser.add_argument('-info', '--info', action='store_true', default=False, help='Prints the total number of programs the required mutilations can produced and exits without producing the sets of programs.')
     parser.add_argument('-d', '--input_dir', help='Name of the input directory.')
     parser.add_argument('-o', '--output_dir', help='Name of the output directory.')
+    parser.add_argument('-j', '--jobs', type=int, default=1, help='Number of programs mutilated in parallel by a pool of worker processes. Use 0 for one worker per core. (Default = 1).')
+    parser.add_argument('-sd', '--seed', type=int, help='Seed of the random choices of the mutilator. Each program is mutilated with its own seed, so resumed runs generate the same programs. (Default = no seed).')
+    parser.add_argument('-ar', '--archive', action='store_true', default=False, help='Writes the mutilated programs of each student and their mappings to a single zip archive ('+archive_name+') instead of one file each.')
+    parser.add_argument('-ds', '--dataset', action='store_true', default=False, help='Writes the mutilated programs of each student, their mutilations and mappings as the rows of a single gzipped JSON Lines file ('+dataset_name+') instead of one file each.')
+    parser.add_argument('-pt', '--patches', action='store_true', default=False, help='Writes the original program of each student to '+original_name+', and the edits that turn it into each of the mutilated programs, together with their mappings, as the rows of a single gzipped JSON Lines file ('+patches_name+') instead of one file each. The programs are rebuilt with apply_patches.py.')
+    parser.add_argument('-vi', '--var_maps', action='store_true', default=False, help='Writes the variable mappings of the mutilated programs of each student to a single file ('+var_maps_name+'), where each distinct mapping is stored once and referenced by its index, instead of one file each. The mappings are read with helper.read_var_maps. Ignored with -ds and -pt.')
+    parser.add_argument('-bi', '--bug_index', action='store_true', default=False, help='Writes the bugs of the mutilated programs of each student as the columns of a single table ('+bugs_name+'), instead of one bug map file each, and joins the tables of all the students in '+bug_index_name+' in the output directory. The bugs are read with load_bug_index and query_bugs.')
+    parser.add_argument('-dd', '--dedup', action='store_true', default=False, help='Skips the mutilated programs whose code is the same as a program already generated for the same student, and prints how many were skipped. The skipped programs are listed in '+aliases_name+' (or as rows with "alias_of" in the dataset).')
+    parser.add_argument('-cd', '--cache_dir', help='Directory where the ASTs of the programs and their analysis are cached between runs. (Default = no cache).')
+    parser.add_argument('-cs', '--cache_size', type=int, default=1024, help='Maximum size of the cache in MB, the least recently used programs are removed first. (Default = 1024).')
     parser.add_argument('-v', '--verbose', action='store_true', default=False, help='Prints debugging information.')
-    args = parser.parse_args(argv[1:])
+    args = parser.parse_args(argv[1:] if arguments is None else arguments)
     return args
 
 
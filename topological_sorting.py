@@ -4,87 +4,188 @@
 #Author			: pmorvalho
 #Date			: May 17, 2022
 #Description 	        : Computes all the topological ordering from a set of nodes and their respective edges.
-#Notes			: Code adapted from https://www.techiedelight.com/find-all-possible-topological-orderings-of-dag/
+#Notes			: The orderings are generated one at a time by an iterative backtracking, in the same order as the recursive version adapted from https://www.techiedelight.com/find-all-possible-topological-orderings-of-dag/
 #Python Version: 3.8.5
 # (C) Copyright 2022 Pedro Orvalho.
 #==============================================================================
 
 import argparse
 from sys import argv
+from math import factorial
 
 class Graph:
  
     def __init__(self, edges, nodes):
  
-        # A list of lists to represent an adjacency list
-        self.paths = []
         self.nodes = nodes
-        self.adjList = dict()
-        for n in nodes:
-            self.adjList[n] = [] 
- 
+        # position of each node in the list of nodes
+        self.pos = dict()
+        for i in range(len(nodes)):
+            self.pos[nodes[i]] = i
+
+        # A list of lists to represent an adjacency list (using the positions of the nodes)
+        self.adjList = [[] for _ in nodes]
         # stores in-degree of a vertex
         # initialize in-degree of each vertex by 0
-        self.indegree = dict()
-
-        for n in nodes:
-            self.indegree[n] = 0
+        self.indegree = [0]*len(nodes)
+        # bitmask with the predecessors of each vertex
+        self.preds = [0]*len(nodes)
         # add edges to the directed graph
         for (src, dest) in edges:
+            s, d = self.pos[src], self.pos[dest]
  
             # add an edge from source to destination
-            self.adjList[src].append(dest)
+            self.adjList[s].append(d)
  
             # increment in-degree of destination vertex by 1
-            self.indegree[dest] = self.indegree[dest] + 1
- 
-# Recursive function to find all topological orderings of a given DAG
-def findAllTopologicalOrderings(graph, path, discovered, nodes):
-    # do for every vertex
-    for v in nodes:
- 
-        # proceed only if the current node's in-degree is 0 and
-        # the current node is not processed yet
-        if graph.indegree[v] == 0 and not discovered[v]:
- 
+            self.indegree[d] = self.indegree[d] + 1
+            self.preds[d] |= 1 << s
+
+    def has_repeated_nodes(self):
+        # a repeated node can never be part of a topological ordering, so these graphs have none
+        return len(self.pos) != len(self.nodes)
+
+    def components(self):
+        # positions of the nodes of each weakly connected component of the graph
+        neighbours = [set() for _ in self.nodes]
+        for s in range(len(self.nodes)):
+            for d in self.adjList[s]:
+                neighbours[s].add(d)
+                neighbours[d].add(s)
+        seen = [False]*len(self.nodes)
+        comps = []
+        for v in range(len(self.nodes)):
+            if seen[v]:
+                continue
+            seen[v] = True
+            comp, stack = [], [v]
+            while stack:
+                u = stack.pop()
+                comp.append(u)
+                for w in neighbours[u]:
+                    if not seen[w]:
+                        seen[w] = True
+                        stack.append(w)
+            comps.append(sorted(comp))
+        return comps
+
+# Generator of all topological orderings of a given DAG.
+# Only the current path is kept in memory, each ordering is yielded as soon as it is complete.
+def genTopologicalOrders(nodes, edges):
+    graph = Graph(edges, nodes)
+    if graph.has_repeated_nodes():
+        return
+    n = len(nodes)
+    discovered = [False]*n
+    indegree = graph.indegree
+    path = []
+    # first vertex to try at the current position of the path
+    start = 0
+    while True:
+        # proceed only with vertices whose in-degree is 0 and that are not processed yet
+        v = start
+        while v < n and (discovered[v] or indegree[v] != 0):
+            v += 1
+        if v < n:
             # for every adjacent vertex `u` of `v`, reduce the in-degree of `u` by 1
             for u in graph.adjList[v]:
-                graph.indegree[u] = graph.indegree[u] - 1
- 
+                indegree[u] -= 1
             # include the current node in the path and mark it as discovered
             path.append(v)
             discovered[v] = True
- 
-            # recur
-            findAllTopologicalOrderings(graph, list(path), discovered, nodes)
- 
-            # backtrack: reset in-degree information for the current node
-            for u in graph.adjList[v]:
-                graph.indegree[u] = graph.indegree[u] + 1
- 
-            # backtrack: remove the current node from the path and
-            # mark it as undiscovered
-            path.pop()
-            discovered[v] = False
- 
-    # print the topological order if all vertices are included in the path
-    if len(path) == len(nodes):
-        graph.paths.append(list(path))
- 
- 
-# Print all topological orderings of a given DAG
+            start = 0
+            if len(path) < n:
+                continue
+        if len(path) == n:
+            yield [nodes[u] for u in path]
+        if path == []:
+            return
+        # backtrack: reset in-degree information for the last node, remove it from the path,
+        # and try the next vertex in its position
+        v = path.pop()
+        discovered[v] = False
+        for u in graph.adjList[v]:
+            indegree[u] += 1
+        start = v + 1
+
+# List of all topological orderings of a given DAG
 def getTopologicalOrders(nodes, edges):
+    return list(genTopologicalOrders(nodes, edges))
 
-    graph = Graph(edges, nodes) 
-    discovered = dict()
-    for n in nodes:
-        discovered[n] = False
- 
-    # list to store the topological order
-    path = []
-    # find all topological ordering and print
-    findAllTopologicalOrderings(graph, path, discovered, nodes)
-    return graph.paths
+# Number of topological orderings of the nodes in comp (their positions) that are not placed yet,
+# memoized over the subsets of nodes already placed
+def countComponentOrders(graph, comp, memo, placed=0):
+    full = 0
+    for v in comp:
+        full |= 1 << v
+    memo[full] = 1
+    def count(placed):
+        if placed in memo:
+            return memo[placed]
+        total = 0
+        for v in comp:
+            if not placed & (1 << v) and graph.preds[v] & placed == graph.preds[v]:
+                total += count(placed | (1 << v))
+        memo[placed] = total
+        return total
+    return count(placed)
+
+# The topological orderings of a given DAG, with random access to the n-th ordering (in the same order as genTopologicalOrders)
+# without enumerating the orderings before it.
+class TopologicalOrders:
+
+    def __init__(self, nodes, edges):
+        self.nodes = nodes
+        self.graph = Graph(edges, nodes)
+        self.comps = self.graph.components()
+        # bitmask with the nodes of each component, and the counts of each component already computed
+        self.comps_masks = []
+        for comp in self.comps:
+            m = 0
+            for v in comp:
+                m |= 1 << v
+            self.comps_masks.append(m)
+        self.memos = [dict() for _ in self.comps]
+        self.size = 0 if self.graph.has_repeated_nodes() else self.count(0)
+
+    def count(self, placed):
+        # number of ways of completing an ordering whose first nodes are the ones in placed.
+        # the orderings of the independent components can be interleaved in n!/(n_1!...n_k!) ways
+        total = factorial(len(self.nodes) - bin(placed).count("1"))
+        for c in range(len(self.comps)):
+            comp = self.comps[c]
+            c_placed = placed & self.comps_masks[c]
+            total //= factorial(len(comp) - bin(c_placed).count("1"))
+            if c_placed != self.comps_masks[c] and (len(comp) > 1 or self.graph.preds[comp[0]] != 0):
+                total *= countComponentOrders(self.graph, comp, self.memos[c], c_placed)
+        return total
+
+    def __len__(self):
+        return self.size
+
+    def __getitem__(self, n):
+        # unranking: at each position choose the first available node whose number of completions is higher than n
+        if n < 0:
+            n += self.size
+        if not 0 <= n < self.size:
+            raise IndexError("topological ordering index out of range")
+        placed = 0
+        order = []
+        for _ in range(len(self.nodes)):
+            for v in range(len(self.nodes)):
+                if placed & (1 << v) or self.graph.preds[v] & placed != self.graph.preds[v]:
+                    continue
+                c = self.count(placed | (1 << v))
+                if n < c:
+                    break
+                n -= c
+            placed |= 1 << v
+            order.append(self.nodes[v])
+        return order
+
+# Counts the topological orderings of a given DAG without listing them
+def countTopologicalOrders(nodes, edges):
+    return TopologicalOrders(nodes, edges).size
     
  
 if __name__ == '__main__':
@@ -98,3 +199,5 @@ if __name__ == '__main__':
  
     # print all topological ordering of the graph
     print(getTopologicalOrders(n, edges))
+    print(countTopologicalOrders(n, edges))
+    print(TopologicalOrders(n, edges)[5])